@@ -0,0 +1,100 @@
+# Imports a CSV file of ROWS tracker rows into a fake sheet that already
+# holds EXISTING rows (a tenth of the file updates rows already there), then
+# exports the whole tracker and one person's month again. Reports the time,
+# the Sheets requests and the peak memory of each, next to the size of the
+# file, to show that neither grows with the file beyond the tracker index.
+#
+#   python -m benchmarks.bulk_transfer [ROWS] [EXISTING] [LATENCY]
+
+from datetime import date, timedelta
+import asyncio
+import csv
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import bulk
+from benchmarks.cell_writes import PEOPLE
+from fake_storage import FakeStorage
+from scheduler import ScheduledStorage
+from tracker import TrackerIndex
+
+HEADERS = ["Date", "Name", "Steps", "Water", "Sleep", "Workout", "Weight"]
+
+def entry(number):
+    day = date(2020, 1, 1) + timedelta(days=number // PEOPLE)
+    return [day.isoformat(), f"Person {number % PEOPLE}", str(5000 + number % 7000), "2", "7.5", "Run", ""]
+
+def write_file(path, rows, existing):
+    # The first rows of the file repeat existing entries, the rest are new.
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADERS)
+        for number in range(existing - rows // 10, existing - rows // 10 + rows):
+            writer.writerow(entry(number))
+
+async def setup(existing, latency):
+    backend = FakeStorage({"Daily Tracker": [HEADERS] + [entry(number) for number in range(existing)]}, latency)
+    storage = ScheduledStorage(backend, 0, 0)
+    index = TrackerIndex(storage)
+    await index.sync()  # import and export rebuild it anyway, as the sheet may have changed
+    return backend.spreadsheet, storage, index
+
+async def timed(make_call, service):
+    service.reset_counters()
+    start = time.perf_counter()
+    result = await make_call()
+    return result, time.perf_counter() - start, service.calls
+
+async def traced(make_call):
+    # Tracing slows everything down, so it gets a run of its own. Kept memory
+    # is what stays allocated afterwards (for an import, mostly the fake
+    # sheet and the index growing); peak adds the working set of the call.
+    tracemalloc.start()
+    await make_call()
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return kept, peak
+
+def megabytes(size):
+    return f"{size / 1024 / 1024:>5.1f} MB"
+
+async def run(rows, existing, latency):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "import.csv")
+        out = os.path.join(directory, "export.csv")
+        write_file(path, rows, existing)
+        size = os.path.getsize(path)
+        print(
+            f"{rows:,} rows in a {size / 1024 / 1024:.1f} MB file, {existing:,} rows in the sheet, "
+            f"{bulk.CHUNK_ROWS:,} rows per chunk, {latency * 1000:g} ms per Sheets request"
+        )
+        print(f"{'':>23} | {'rows':>7} | {'time':>7} | {'requests':>8} | {'kept':>8} | {'peak':>8}")
+
+        service, storage, index = await setup(existing, latency)
+        result, elapsed, calls = await timed(lambda: bulk.import_rows(bulk.table_rows(path), index, storage), service)
+        _, fresh_storage, fresh_index = await setup(existing, 0)
+        kept, peak = await traced(lambda: bulk.import_rows(bulk.table_rows(path), fresh_index, fresh_storage))
+        print(
+            f"{'import':>23} | {result['rows']:>7,} | {elapsed:>5.2f} s | {calls:>8} | {megabytes(kept)} | {megabytes(peak)}"
+            f"   ({result['added']:,} added, {result['updated']:,} updated)"
+        )
+
+        # Exports only read, so both runs use the sheet the import filled.
+        last_day = entry(existing - rows // 10 + rows - 1)[0]
+        exports = [
+            ("export everything", {}),
+            ("export a person's month", {"first_date": last_day[:8] + "01", "last_date": last_day, "name": "Person 0"}),
+        ]
+        for label, options in exports:
+            count, elapsed, calls = await timed(lambda: bulk.export_rows(index, storage, out, **options), service)
+            kept, peak = await traced(lambda: bulk.export_rows(index, storage, out, **options))
+            print(f"{label:>23} | {count:>7,} | {elapsed:>5.2f} s | {calls:>8} | {megabytes(kept)} | {megabytes(peak)}")
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    existing = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    asyncio.run(run(rows, existing, latency))
@@ -0,0 +1,74 @@
+# Compares the bytes sent and the simulated latency of /update and
+# /batchupdate writes against the old approach of rewriting the whole
+# "Daily Tracker!A1:Z" range, for growing sheet sizes. Bytes are what each
+# command uploads; latency is the whole command including its reads.
+#
+#   python -m benchmarks.cell_writes [ROWS ...]
+
+from datetime import date, datetime, timedelta
+import asyncio
+import sys
+import time
+
+import pytz
+
+import fitness_bot
+import sheets
+from benchmarks import stand_in
+from scheduler import ScheduledStorage
+from storage import SheetsStorage
+
+HEADERS = ["Date", "Name", "Steps", "Water", "Sleep", "Workout"]
+PEOPLE = 5
+LATENCY = 0.05
+BANDWIDTH = 1_000_000  # bytes per second
+
+def tracker_rows(rows, today):
+    data = [list(HEADERS)]
+    day = date.fromisoformat(today)
+    while len(data) <= rows:
+        day -= timedelta(days=1)
+        for person in range(PEOPLE):
+            data.append([day.isoformat(), f"Person {person}", "1000", "2", "7", "Run"])
+    data = data[:rows + 1]
+    data.append([today, "Person 0", "500", "", "", ""])
+    return data
+
+async def measure(write):
+    service = sheets._service
+    service.reset_counters()
+    start = time.perf_counter()
+    await write()
+    return service.bytes_sent, time.perf_counter() - start
+
+async def run(sizes):
+    today = datetime.now(pytz.timezone(fitness_bot.TIMEZONE)).strftime("%Y-%m-%d")
+    print(f"{'rows':>8} | {'full rewrite':>22} | {'/update cell':>22} | {'/batchupdate cells':>22}")
+    for rows in sizes:
+        data = tracker_rows(rows, today)
+        sheets._service = stand_in.StandInService({"Daily Tracker": data}, LATENCY, BANDWIDTH)
+        stand_in.use_storage(ScheduledStorage(SheetsStorage(fitness_bot.SPREADSHEET_ID)))
+
+        full = await measure(lambda: sheets.update_values(fitness_bot.SPREADSHEET_ID, "Daily Tracker!A1:Z", data))
+
+        async def single():
+            replies = []
+            ctx = stand_in.context(user_data={stand_in.CHAT_ID: {"name": "Person 0", "column": "Water"}})
+            await fitness_bot.update_value(stand_in.message_update(replies, "3"), ctx)
+        cell = await measure(single)
+
+        replies = []
+        ctx = stand_in.context(user_data={})
+        await fitness_bot.batch_update_columns(stand_in.callback_update(replies, "Person 0"), ctx)
+
+        async def batch():
+            await fitness_bot.batch_update_process(
+                stand_in.message_update(replies, "Steps: 9000\nSleep: 8\nWorkout: Swim"), ctx
+            )
+        cells = await measure(batch)
+
+        print(" | ".join([f"{rows:>8}"] + [f"{sent:>10,} B {elapsed * 1000:>7.1f} ms" for sent, elapsed in (full, cell, cells)]))
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1_000, 10_000, 50_000]
+    asyncio.run(run(sizes))
@@ -0,0 +1,210 @@
+# Drives the real command handlers, step by step as Telegram would call
+# them, against the in-memory fake sheet behind the same request scheduler
+# the bot uses. For each sheet size, every flow is run by CONCURRENCY users
+# at once, REPEATS times, and the suite reports the p50/p99 time of a whole
+# command, the Sheets requests per command (on the first run, with nothing
+# cached, and on average) and the peak memory allocated while it runs.
+#
+# Results can be saved and compared with an earlier run; --compare exits
+# with status 1 when a command makes more Sheets requests than before, or
+# its p99 grew by more than the tolerance, so it can run before a deploy.
+#
+#   python -m benchmarks.command_flows [--rows 10 1000 ...] [--concurrency N]
+#       [--repeats N] [--latency SECONDS] [--save FILE] [--compare FILE]
+
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+
+import pytz
+
+import fitness_bot
+from benchmarks import stand_in
+from benchmarks.cell_writes import PEOPLE, tracker_rows
+from fake_storage import FakeStorage
+from reminders import _percentile
+from scheduler import ScheduledStorage
+
+# Each step is (handler, "message" or "callback", text). "{name}" is
+# replaced by the person of the user running the flow.
+FLOWS = {
+    "/update": [
+        (fitness_bot.update_start, "message", ""),
+        (fitness_bot.select_name, "callback", "{name}"),
+        (fitness_bot.select_column, "callback", "Steps"),
+        (fitness_bot.update_value, "message", "12345"),
+    ],
+    "/batchupdate": [
+        (fitness_bot.batch_update_start, "message", ""),
+        (fitness_bot.batch_update_columns, "callback", "{name}"),
+        (fitness_bot.batch_update_process, "message", "Steps: 23456\nWater: 3"),
+    ],
+    "/viewtoday": [
+        (fitness_bot.view_today, "message", ""),
+    ],
+    "/weekly": [
+        (fitness_bot.weekly_stats, "message", ""),
+        (fitness_bot.handle_weekly_callback, "callback", "weekly_{name}"),
+    ],
+    "/viewgoals": [
+        (fitness_bot.view_goals, "message", ""),
+        (fitness_bot.handle_viewgoals_callback, "callback", "viewgoals_{name}"),
+    ],
+    "/addgoal": [
+        (fitness_bot.add_goal_start, "message", ""),
+        (fitness_bot.add_goal_name, "callback", "{name}"),
+        (fitness_bot.add_goal_description, "message", "Swim"),
+        (fitness_bot.finalize_goal_description, "message", "1k every week"),
+    ],
+    "/editgoal": [
+        (fitness_bot.edit_goal_start, "message", ""),
+        (fitness_bot.select_goal_to_edit, "callback", "{name}"),
+        (fitness_bot.edit_goal_description, "callback", "Goal 0"),
+        (fitness_bot.finalize_edit_goal, "message", "10k every week"),
+    ],
+}
+
+def sheet(rows, today):
+    goals = [["Name", "Goal Name", "Description"]] + [
+        [f"Person {i % PEOPLE}", f"Goal {i // PEOPLE}", "Keep going"] for i in range(50)
+    ]
+    tracker = tracker_rows(rows, today)
+    tracker[1:] = sorted(tracker[1:])  # oldest first, as the bot appends them
+    return {
+        "Daily Tracker": tracker,
+        "People": [[f"Person {i}"] for i in range(PEOPLE)],
+        "Goals": goals,
+    }
+
+async def run_flow(steps, user):
+    # Runs one command from start to end; returns its time and whether any
+    # step answered with an error.
+    name = f"Person {user % PEOPLE}"
+    user_data = {}
+    replies = []
+    start = time.perf_counter()
+    for handler, kind, text in steps:
+        text = text.format(name=name)
+        if kind == "message":
+            update = stand_in.message_update(replies, text)
+        else:
+            update = stand_in.callback_update(replies, text)
+        await handler(update, stand_in.context(user_data=user_data))
+    failed = any(str(reply).startswith("Error") for reply in replies)
+    return time.perf_counter() - start, failed
+
+async def run_round(steps, concurrency):
+    return await asyncio.gather(*(run_flow(steps, user) for user in range(concurrency)))
+
+async def measure(command, steps, rows, today, concurrency, repeats, latency):
+    backend = FakeStorage(sheet(rows, today), latency)
+    stand_in.use_storage(ScheduledStorage(backend, 0, 0))
+    service = backend.spreadsheet
+
+    timings = []
+    failures = 0
+    first_calls = None
+    for _ in range(repeats):
+        service.reset_counters()
+        results = await run_round(steps, concurrency)
+        timings.extend(seconds for seconds, _ in results)
+        failures += sum(failed for _, failed in results)
+        if first_calls is None:
+            first_calls = service.calls / concurrency
+            total_calls = 0
+        else:
+            total_calls += service.calls
+    average_calls = total_calls / (concurrency * (repeats - 1)) if repeats > 1 else first_calls
+
+    # One more round with allocations traced; tracing slows everything down,
+    # so it is kept out of the timings.
+    tracemalloc.start()
+    await run_round(steps, concurrency)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "command": command,
+        "rows": rows,
+        "p50": _percentile(timings, 50),
+        "p99": _percentile(timings, 99),
+        "first_calls": first_calls,
+        "calls": average_calls,
+        "peak_bytes": peak,
+        "failures": failures,
+    }
+
+def compare(results, baseline, tolerance, min_change):
+    # Returns the lines describing regressions against an earlier run. Times
+    # only count when they grew by more than min_change seconds too, as
+    # sub-millisecond timings are mostly noise.
+    earlier = {(result["command"], result["rows"]): result for result in baseline["results"]}
+    problems = []
+    for result in results:
+        before = earlier.get((result["command"], result["rows"]))
+        if before is None:
+            continue
+        label = f"{result['command']} at {result['rows']:,} rows"
+        for key in ("first_calls", "calls"):
+            if result[key] > before[key] + 1e-9:
+                problems.append(f"{label}: {result[key]:.1f} Sheets requests per command, was {before[key]:.1f}")
+        grown = result["p99"] - before["p99"]
+        if result["p99"] > before["p99"] * (1 + tolerance) and grown > min_change:
+            problems.append(f"{label}: p99 {result['p99'] * 1000:.1f} ms, was {before['p99'] * 1000:.1f} ms")
+        if result["failures"] > before["failures"]:
+            problems.append(f"{label}: {result['failures']} failed commands, was {before['failures']}")
+    return problems
+
+async def run(options):
+    today = datetime.now(pytz.timezone(fitness_bot.TIMEZONE)).strftime("%Y-%m-%d")
+    commands = options.commands or list(FLOWS)
+    print(
+        f"{options.concurrency} users at once, {options.repeats} runs, "
+        f"{options.latency * 1000:g} ms per Sheets request"
+    )
+    print(
+        f"{'rows':>8} | {'command':>12} | {'p50':>9} | {'p99':>9} | "
+        f"{'calls first':>11} | {'calls':>5} | {'peak memory':>11} | {'failed':>6}"
+    )
+    results = []
+    for rows in options.rows:
+        for command in commands:
+            result = await measure(
+                command, FLOWS[command], rows, today, options.concurrency, options.repeats, options.latency
+            )
+            results.append(result)
+            print(
+                f"{rows:>8,} | {command:>12} | {result['p50'] * 1000:>6.1f} ms | {result['p99'] * 1000:>6.1f} ms | "
+                f"{result['first_calls']:>11.1f} | {result['calls']:>5.1f} | "
+                f"{result['peak_bytes'] / 1024:>8,.0f} KB | {result['failures']:>6}"
+            )
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump({"options": vars(options), "results": results}, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            problems = compare(results, json.load(f), options.tolerance, options.min_change)
+        if problems:
+            print("\nRegressions:")
+            print("\n".join(problems))
+            return 1
+        print("\nNo regressions.")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the bot's commands against a fake sheet.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 1_000, 10_000, 100_000])
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per Sheets request")
+    parser.add_argument("--commands", nargs="+", choices=list(FLOWS))
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with results saved earlier")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p99 growth (default 0.25)")
+    parser.add_argument("--min-change", type=float, default=0.005, help="ignore p99 growth below this many seconds")
+    sys.exit(asyncio.run(run(parser.parse_args())))
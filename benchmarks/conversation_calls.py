@@ -0,0 +1,75 @@
+# Walks through /update, /batchupdate, /addgoal and /editgoal step by step
+# against the fake sheet and counts the Sheets requests each step makes, once
+# with nothing cached and once more right after.
+#
+#   python -m benchmarks.conversation_calls [ROWS]
+
+from datetime import datetime
+import asyncio
+import sys
+
+import pytz
+
+import fitness_bot
+from benchmarks import stand_in
+from benchmarks.cell_writes import tracker_rows
+from fake_storage import FakeStorage
+
+FLOWS = {
+    "/update": [
+        (fitness_bot.update_start, "message", ""),
+        (fitness_bot.select_name, "callback", "Person 0"),
+        (fitness_bot.select_column, "callback", "Steps"),
+        (fitness_bot.update_value, "message", "12345"),
+    ],
+    "/batchupdate": [
+        (fitness_bot.batch_update_start, "message", ""),
+        (fitness_bot.batch_update_columns, "callback", "Person 0"),
+        (fitness_bot.batch_update_process, "message", "Steps: 23456"),
+    ],
+    "/addgoal": [
+        (fitness_bot.add_goal_start, "message", ""),
+        (fitness_bot.add_goal_name, "callback", "Person 0"),
+        (fitness_bot.add_goal_description, "message", "Run"),
+        (fitness_bot.finalize_goal_description, "message", "5k every week"),
+    ],
+    "/editgoal": [
+        (fitness_bot.edit_goal_start, "message", ""),
+        (fitness_bot.select_goal_to_edit, "callback", "Person 0"),
+        (fitness_bot.edit_goal_description, "callback", "Goal 0"),
+        (fitness_bot.finalize_edit_goal, "message", "10k every week"),
+    ],
+}
+
+async def walk(backend, steps):
+    user_data = {}
+    calls = []
+    for handler, kind, text in steps:
+        backend.spreadsheet.reset_counters()
+        replies = []
+        if kind == "message":
+            update = stand_in.message_update(replies, text)
+        else:
+            update = stand_in.callback_update(replies, text)
+        await handler(update, stand_in.context(user_data=user_data))
+        calls.append(backend.spreadsheet.calls)
+    return calls
+
+async def run(rows):
+    today = datetime.now(pytz.timezone(fitness_bot.TIMEZONE)).strftime("%Y-%m-%d")
+    goals = [["Name", "Goal Name", "Description"]] + [[f"Person {i % 5}", f"Goal {i // 5}", "Keep going"] for i in range(50)]
+    print(f"{'command':>12} | {'first run':<22} | {'right after':<22}")
+    for command, steps in FLOWS.items():
+        backend = stand_in.use_storage(FakeStorage({
+            "Daily Tracker": tracker_rows(rows, today),
+            "People": [[f"Person {i}"] for i in range(5)],
+            "Goals": [list(row) for row in goals],
+        }))
+        cold = await walk(backend, steps)
+        warm = await walk(backend, steps)
+        cold, warm = (f"{sum(calls):>3} ({' + '.join(map(str, calls))})" for calls in (cold, warm))
+        print(f"{command:>12} | {cold:<22} | {warm:<22}")
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000
+    asyncio.run(run(rows))
@@ -0,0 +1,53 @@
+# Opens CONVERSATIONS /batchupdate conversations against sheets of growing
+# size and reports the memory kept per open conversation, next to the size
+# of the whole-sheet snapshot each conversation used to keep. Also checks
+# that finished conversations leave nothing behind.
+#
+#   python -m benchmarks.conversation_state [CONVERSATIONS] [ROWS ...]
+
+from datetime import datetime
+import asyncio
+import sys
+
+import pytz
+
+import fitness_bot
+from benchmarks import stand_in
+from benchmarks.cell_writes import tracker_rows
+from fake_storage import FakeStorage
+
+def deep_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key) + deep_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_size(item) for item in value)
+    return size
+
+async def run(conversations, sizes):
+    today = datetime.now(pytz.timezone(fitness_bot.TIMEZONE)).strftime("%Y-%m-%d")
+    print(f"{'rows':>8} | {'per conversation':>16} | {'sheet snapshot':>14} | {'keys left after end':>19}")
+    for rows in sizes:
+        data = tracker_rows(rows, today)
+        stand_in.use_storage(FakeStorage({"Daily Tracker": data}))
+
+        replies = []
+        states = [{} for _ in range(conversations)]
+        for user_data in states:
+            await fitness_bot.batch_update_columns(
+                stand_in.callback_update(replies, "Person 0"), stand_in.context(user_data=user_data)
+            )
+        per_conversation = sum(deep_size(user_data) for user_data in states) / conversations
+
+        for user_data in states:
+            await fitness_bot.batch_update_process(
+                stand_in.message_update(replies, "Steps: 9000"), stand_in.context(user_data=user_data)
+            )
+        left = sum(len(user_data) for user_data in states)
+
+        print(f"{rows:>8} | {per_conversation:>14,.0f} B | {deep_size(data):>12,} B | {left:>19}")
+
+if __name__ == "__main__":
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    sizes = [int(arg) for arg in sys.argv[2:]] or [100, 1_000, 10_000, 50_000]
+    asyncio.run(run(conversations, sizes))
@@ -0,0 +1,44 @@
+# Times CALLS /viewtoday commands against the in-memory fake sheet with
+# metrics off (handlers not wrapped) and on (handler wrapped, Sheets requests
+# and quota waits timed), and reports the cost per command.
+#
+#   python -m benchmarks.metrics_overhead [CALLS]
+
+from datetime import datetime
+import asyncio
+import sys
+import time
+
+import pytz
+
+import fitness_bot
+from benchmarks import stand_in
+from benchmarks.cell_writes import tracker_rows
+from fake_storage import FakeStorage
+from metrics import metrics
+from scheduler import ScheduledStorage
+
+async def time_calls(handler, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        await handler(stand_in.message_update([]), stand_in.context())
+    return (time.perf_counter() - start) / calls
+
+async def run(calls):
+    today = datetime.now(pytz.timezone(fitness_bot.TIMEZONE)).strftime("%Y-%m-%d")
+    stand_in.use_storage(ScheduledStorage(FakeStorage({"Daily Tracker": tracker_rows(100, today)}), 0, 0))
+
+    metrics.enabled = False
+    await time_calls(fitness_bot.view_today, calls)  # warm up
+    off = await time_calls(fitness_bot.view_today, calls)
+    metrics.enabled = True
+    on = await time_calls(metrics.instrument(fitness_bot.view_today), calls)
+    metrics.enabled = False
+
+    print(f"{calls} /viewtoday, {sum(h.count for h in metrics.histograms.values())} timings recorded")
+    print(f"  metrics off: {off * 1e6:8.1f} us per command")
+    print(f"  metrics on:  {on * 1e6:8.1f} us per command ({(on - off) * 1e6:+.1f} us)")
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    asyncio.run(run(calls))
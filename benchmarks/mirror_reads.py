@@ -0,0 +1,80 @@
+# Times /viewtoday, /viewgoals and /weekly served from Google Sheets (a
+# stand-in with LATENCY seconds per request) and from the local SQLite copy,
+# for a tracker of ROWS rows.
+#
+#   python -m benchmarks.mirror_reads [ROWS] [LATENCY]
+
+from datetime import datetime
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import pytz
+
+import fitness_bot
+from benchmarks import stand_in
+from benchmarks.cell_writes import tracker_rows
+from fake_storage import FakeStorage
+from mirror import SheetMirror
+from reminders import _percentile
+from weekly import WeeklyStats
+import tenants
+
+REPEATS = 20
+COMMANDS = [
+    ("/viewtoday", fitness_bot.view_today, []),
+    ("/viewgoals", fitness_bot.view_goals, ["Person 0"]),
+    ("/weekly", fitness_bot.weekly_stats, ["Person 0"]),
+]
+
+async def time_commands(service):
+    results = []
+    for label, handler, args in COMMANDS:
+        service.reset_counters()
+        timings = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            await handler(stand_in.message_update([]), stand_in.context(args=args))
+            timings.append(time.perf_counter() - start)
+        results.append((label, _percentile(timings, 50), service.calls / REPEATS))
+    return results
+
+async def run(rows, latency):
+    today = datetime.now(pytz.timezone(fitness_bot.TIMEZONE)).strftime("%Y-%m-%d")
+    goals = [["Name", "Goal Name", "Description"]] + [[f"Person {i % 5}", f"Goal {i}", "Keep going"] for i in range(50)]
+    tracker = tracker_rows(rows, today)
+    tracker[1:] = sorted(tracker[1:])  # oldest first, as the bot appends them
+    backend = stand_in.use_storage(FakeStorage(
+        {"Daily Tracker": tracker, "People": [[f"Person {i}"] for i in range(5)], "Goals": goals},
+        latency,
+    ))
+    service = backend.spreadsheet
+    from_sheets = await time_commands(service)
+
+    with tempfile.TemporaryDirectory() as folder:
+        tenant = tenants.current()
+        tenant.mirror = SheetMirror(backend, os.path.join(folder, "mirror.db"))
+        tenant.weekly_stats_engine = WeeklyStats(tenant.tracker_index, tenant.mirror)
+        start = time.perf_counter()
+        await tenant.mirror.sync()
+        first_sync = time.perf_counter() - start
+        start = time.perf_counter()
+        await tenant.mirror.sync()
+        later_sync = time.perf_counter() - start
+        from_mirror = await time_commands(service)
+
+    print(f"{rows} rows, {latency * 1000:.0f} ms per Sheets request")
+    print(f"first sync {first_sync * 1000:.1f} ms, incremental sync {later_sync * 1000:.1f} ms")
+    print(f"{'command':>10} | {'Sheets p50':>12} | {'calls':>5} | {'mirror p50':>12} | {'calls':>5}")
+    for (label, sheets_p50, sheets_calls), (_, mirror_p50, mirror_calls) in zip(from_sheets, from_mirror):
+        print(
+            f"{label:>10} | {sheets_p50 * 1000:>9.2f} ms | {sheets_calls:>5.1f} | "
+            f"{mirror_p50 * 1000:>9.2f} ms | {mirror_calls:>5.1f}"
+        )
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    asyncio.run(run(rows, latency))
@@ -0,0 +1,37 @@
+# Builds the name keyboard of /update for People lists of growing size, once
+# with a button per person (as the bot used to) and once paged and cached,
+# and reports the build time and the size of the keyboard sent to Telegram.
+#
+#   python -m benchmarks.name_keyboards [PEOPLE ...]
+
+import sys
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from keyboards import KeyboardCache
+
+REPEATS = 100
+
+def one_button_each(names):
+    return InlineKeyboardMarkup([[InlineKeyboardButton(name, callback_data=name)] for name in names])
+
+def timed(build):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        markup = build()
+    return (time.perf_counter() - start) / REPEATS, len(markup.to_json())
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1_000, 5_000]
+    print(f"{'people':>7} | {'all buttons':>11} | {'bytes':>8} | {'paged, cached':>13} | {'bytes':>5} | {'search':>9}")
+    for count in sizes:
+        names = [f"Person {i}" for i in range(count)]
+        cache = KeyboardCache()
+        old_time, old_size = timed(lambda: one_button_each(names))
+        new_time, new_size = timed(lambda: cache.markup("people", names)[0])
+        search_time, _ = timed(lambda: cache.markup("people", names, search="person 12")[0])
+        print(
+            f"{count:>7} | {old_time * 1000:>8.2f} ms | {old_size:>8,} | {new_time * 1000:>10.3f} ms | "
+            f"{new_size:>5,} | {search_time * 1000:>6.3f} ms"
+        )
@@ -0,0 +1,77 @@
+# Reminder delivery for CHATS subscribed chats against a stand-in Telegram
+# API that enforces a flood limit of FLOOD_LIMIT sends per second.
+#
+# "per-send loop" replays the original delivery path: every send ran on a
+# BackgroundScheduler worker thread (10 by default) inside a brand-new event
+# loop, paying for a new HTTP session each time, with no rate limiting or
+# retries. "broadcaster" is the current path: send_reminders queues the run
+# on the application loop, rate limited to RATE sends per second, retrying
+# after flood waits. Spreading over the minute is switched off here so the
+# numbers show raw throughput.
+#
+#   python -m benchmarks.reminder_sends [CHATS] [LATENCY] [RATE] [FLOOD_LIMIT]
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from telegram import Bot
+
+import fitness_bot
+from reminders import Broadcaster, ReminderStore
+from benchmarks import stand_in
+
+SESSION_SETUP = 0.1
+
+def per_send_loop(bot, chat_ids):
+    failed = 0
+
+    def send(chat_id):
+        nonlocal failed
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(bot.send_message(chat_id=chat_id, text=fitness_bot.REMINDER_TEXTS["water"]))
+        except Exception:
+            failed += 1
+        finally:
+            loop.close()
+
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        list(pool.map(send, chat_ids))
+    return failed
+
+def report(label, request, failed, elapsed):
+    print(
+        f"  {label:<15} {len(request.sent):>6} delivered, {failed:>5} failed, {request.refused:>5} refused (429) "
+        f"in {elapsed:6.2f}s  ({len(request.sent) / elapsed:6.1f} sends/s)"
+    )
+
+def main(chats, latency, rate, flood_limit):
+    with tempfile.TemporaryDirectory() as directory:
+        fitness_bot.reminder_store = ReminderStore(os.path.join(directory, "reminders.db"))
+        chat_ids = list(range(1, chats + 1))
+        for chat_id in chat_ids:
+            fitness_bot.reminder_store.subscribe(chat_id)
+
+        print(f"{chats} chats, {latency * 1000:.0f} ms per send, flood limit {flood_limit}/s, broadcaster rate {rate:g}/s")
+
+        request = stand_in.StandInTelegramRequest(latency, SESSION_SETUP, flood_limit)
+        start = time.perf_counter()
+        failed = per_send_loop(Bot("0:bench", request=request), chat_ids)
+        report("per-send loop", request, failed, time.perf_counter() - start)
+
+        request = stand_in.StandInTelegramRequest(latency, SESSION_SETUP, flood_limit)
+        fitness_bot.broadcaster = Broadcaster(rate=rate, spread=0)
+        start = time.perf_counter()
+        run = asyncio.run(fitness_bot.send_reminders("water", Bot("0:bench", request=request)))
+        report("broadcaster", request, run["failed"], time.perf_counter() - start)
+
+if __name__ == "__main__":
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else 30
+    flood_limit = int(sys.argv[4]) if len(sys.argv) > 4 else 30
+    main(chats, latency, rate, flood_limit)
@@ -0,0 +1,47 @@
+# Renders the /viewtoday listing for groups of growing size, once by adding
+# each entry to one string (as the bot used to) and once split into pages,
+# and reports the time taken, the longest message and the number of pages.
+# Telegram refuses messages over 4096 characters.
+#
+#   python -m benchmarks.render_pages [ENTRIES ...]
+
+import sys
+import time
+
+from render import MESSAGE_LIMIT, entry_blocks, paginate
+
+HEADERS = ["Date", "Name", "Steps", "Water", "Sleep", "Workout", "Notes"]
+
+def entries(count):
+    return [
+        dict(zip(HEADERS, ["2024-06-03", f"Person {i}", str(8000 + i), "2.5", "7", "Run 5k", "Felt good " * (i % 4)]))
+        for i in range(count)
+    ]
+
+def concatenated(today_entries):
+    response = "Today's Entries:\n"
+    for entry in today_entries:
+        response += "\n".join(f"{key}: {value}" for key, value in entry.items() if value)
+        response += "\n---\n"
+    return [response.strip()]
+
+def paged(today_entries):
+    return list(paginate("Today's Entries:", entry_blocks(today_entries)))
+
+def measure(render, today_entries):
+    start = time.perf_counter()
+    messages = render(today_entries)
+    return time.perf_counter() - start, messages
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1_000, 10_000, 50_000]
+    print(f"{'entries':>8} | {'one string':>10} | {'longest':>9} | {'paged':>9} | {'longest':>7} | {'pages':>5}")
+    for count in sizes:
+        today_entries = entries(count)
+        old_time, old = measure(concatenated, today_entries)
+        new_time, new = measure(paged, today_entries)
+        assert max(len(page) for page in new) <= MESSAGE_LIMIT
+        print(
+            f"{count:>8} | {old_time * 1000:>7.1f} ms | {max(map(len, old)):>9,} | "
+            f"{new_time * 1000:>6.1f} ms | {max(map(len, new)):>7,} | {len(new):>5}"
+        )
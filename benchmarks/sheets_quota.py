@@ -0,0 +1,91 @@
+# Sends COMMANDS /viewtoday commands, a few milliseconds apart, while a
+# background loop keeps reading the sheet like the local copy's sync does,
+# against a fake sheet that allows BUDGET reads per quota window. Compares
+# sending every request straight away with going through the scheduler, and
+# reports failed commands, reply times and the requests Sheets refused.
+# The quota window is shortened to WINDOW seconds so the run stays short.
+#
+#   python -m benchmarks.sheets_quota [COMMANDS] [BUDGET] [WINDOW]
+
+from datetime import datetime
+import asyncio
+import sys
+import time
+
+import pytz
+
+import fitness_bot
+import scheduler
+from benchmarks import stand_in
+from benchmarks.cell_writes import tracker_rows
+from fake_storage import FakeStorage
+from reminders import _percentile
+from scheduler import ScheduledStorage
+import tenants
+
+LATENCY = 0.02
+GAP = 0.01  # seconds between commands arriving
+
+async def background_reads(stop):
+    scheduler.run_in_background()
+    reads = 0
+    while not stop.is_set():
+        try:
+            await tenants.current().storage.read_many(["'People'", "Daily Tracker!1:1", "Daily Tracker!A2:C"])
+            reads += 1
+        except Exception:
+            pass
+        await asyncio.sleep(0)
+    return reads
+
+async def send_commands(commands):
+    async def one():
+        replies = []
+        start = time.perf_counter()
+        await fitness_bot.view_today(stand_in.message_update(replies), stand_in.context())
+        return time.perf_counter() - start, replies[0].startswith("Error")
+
+    tasks = []
+    for _ in range(commands):
+        tasks.append(asyncio.create_task(one()))
+        await asyncio.sleep(GAP)
+    return await asyncio.gather(*tasks)
+
+async def run_mode(label, commands, budget, window, scheduled):
+    today = datetime.now(pytz.timezone(fitness_bot.TIMEZONE)).strftime("%Y-%m-%d")
+    backend = FakeStorage(
+        {"Daily Tracker": tracker_rows(200, today), "People": [[f"Person {i}"] for i in range(5)]},
+        LATENCY, reads_per_minute=budget, writes_per_minute=budget, window=window,
+    )
+    storage = backend
+    if scheduled:
+        storage = ScheduledStorage(backend, budget, budget, base_delay=window / 20, max_delay=window, window=window)
+    stand_in.use_storage(storage)
+
+    stop = asyncio.Event()
+    background = asyncio.create_task(background_reads(stop))
+    start = time.perf_counter()
+    results = await send_commands(commands)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    background_done = await background
+
+    timings = [timing for timing, _ in results]
+    failed = sum(error for _, error in results)
+    merged = storage.stats["merged"] if scheduled else 0
+    print(
+        f"{label:>9} | {failed:>6} | {_percentile(timings, 50) * 1000:>8.1f} | {_percentile(timings, 99) * 1000:>8.1f} | "
+        f"{background_done:>10} | {backend.spreadsheet.calls:>5} | {backend.spreadsheet.rejected:>7} | {merged:>6} | {elapsed:>6.2f}"
+    )
+
+async def run(commands, budget, window):
+    print(f"{commands} /viewtoday, {budget} reads per {window:g}s window, {LATENCY * 1000:.0f} ms per request")
+    print(f"{'mode':>9} | {'failed':>6} | {'p50 ms':>8} | {'p99 ms':>8} | {'background':>10} | {'calls':>5} | {'refused':>7} | {'merged':>6} | {'secs':>6}")
+    await run_mode("direct", commands, budget, window, scheduled=False)
+    await run_mode("scheduled", commands, budget, window, scheduled=True)
+
+if __name__ == "__main__":
+    commands = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    budget = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    window = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+    asyncio.run(run(commands, budget, window))
@@ -0,0 +1,191 @@
+# Stand-ins for the external services used by the benchmarks.
+#
+# StandInService replaces the spreadsheets() resource of the Google client, so
+# the real client layer in sheets.py (executor threads, concurrency limit,
+# timeouts) is exercised too. The sheet itself is a FakeSpreadsheet; the
+# latency is slept in the calling thread, as a blocking HTTP call would.
+
+from types import SimpleNamespace
+import asyncio
+import json
+import time
+
+from fake_storage import FakeSpreadsheet
+from tenants import Tenant
+from weekly import WeeklyStats
+import fitness_bot
+import tenants
+
+class _Request:
+    def __init__(self, service, kind, body, run):
+        self.service = service
+        self.kind = kind
+        self.body = body
+        self.run = run
+
+    def execute(self, http=None):
+        result, delay = self.service.request(self.kind, self.body, self.run)
+        if delay:
+            time.sleep(delay)
+        return result
+
+class _Values:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return _Request(self.service, "read", None, lambda: {"range": range, "values": self.service.read(range)})
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        return _Request(self.service, "read", None, lambda: {
+            "valueRanges": [{"range": r, "values": self.service.read(r)} for r in ranges]
+        })
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        def run():
+            self.service.write(range, body["values"])
+            return {"updatedRange": range}
+        return _Request(self.service, "write", body, run)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            for entry in body["data"]:
+                self.service.check_write(entry["range"], entry["values"])
+            for entry in body["data"]:
+                self.service.write(entry["range"], entry["values"])
+            return {"totalUpdatedCells": sum(len(row) for entry in body["data"] for row in entry["values"])}
+        return _Request(self.service, "write", body, run)
+
+    def append(self, spreadsheetId, range, valueInputOption, body, **kwargs):
+        def run():
+            updated_range = self.service.append(range, body["values"])
+            return {"updates": {"updatedRange": updated_range, "updatedRows": len(body["values"])}}
+        return _Request(self.service, "write", body, run)
+
+class StandInService(FakeSpreadsheet):
+    def __init__(self, tabs=None, latency=0.0, bandwidth=0.0, reads_per_minute=None, writes_per_minute=None):
+        super().__init__(tabs, latency, bandwidth, reads_per_minute, writes_per_minute)
+        self._values = _Values(self)
+
+    def values(self):
+        return self._values
+
+    def get(self, spreadsheetId, fields=None):
+        return _Request(self, "read", None, lambda: {"sheets": self.sheets()})
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            titles = list(self.tabs)
+            for request in body["requests"]:
+                dimension = request["appendDimension"]
+                if dimension["dimension"] == "COLUMNS":
+                    self.append_columns(titles[dimension["sheetId"]], dimension["length"])
+            return {"replies": [{} for _ in body["requests"]]}
+        return _Request(self, "write", body, run)
+
+CHAT_ID = 1
+
+def use_storage(backend):
+    # Makes a tenant reading and writing backend (a storage.Storage, usually
+    # a fake_storage.FakeStorage) the current one, with a fresh index and
+    # caches and no mirror or write-behind journal. Call it from the task
+    # that runs the handlers, or before starting their tasks.
+    tenant = fitness_bot.make_tenant(Tenant(CHAT_ID, None, fitness_bot.TIMEZONE), backend)
+    tenant.mirror = None
+    tenant.write_behind = None
+    tenant.weekly_stats_engine = WeeklyStats(tenant.tracker_index)
+    tenants.use(tenant)
+    return backend
+
+# Minimal Update/Context objects for driving handlers directly.
+
+def _message(replies):
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+    return SimpleNamespace(reply_text=reply_text)
+
+USER = SimpleNamespace(id=1)
+CHAT = SimpleNamespace(id=CHAT_ID, type="group")
+
+def message_update(replies, text=""):
+    message = _message(replies)
+    message.text = text
+    return SimpleNamespace(message=message, effective_message=message, effective_user=USER, effective_chat=CHAT)
+
+def callback_update(replies, data):
+    async def answer(*args, **kwargs):
+        pass
+    query = SimpleNamespace(data=data, answer=answer, message=_message(replies))
+    return SimpleNamespace(callback_query=query, effective_message=query.message, effective_user=USER, effective_chat=CHAT)
+
+def context(args=None, user_data=None):
+    # user_data holds one dict of conversation state per chat, as the bot
+    # keeps it; see fitness_bot.conversation().
+    application = SimpleNamespace(drop_user_data=lambda user_id: None)
+    return SimpleNamespace(args=args or [], user_data={} if user_data is None else user_data, application=application)
+
+# Telegram Bot API stand-in: plugs into telegram.Bot as its request object,
+# answers every call after `latency` seconds and charges `session_setup`
+# seconds the first time it is used from a new event loop, like opening a new
+# HTTPS connection pool would. With `flood_limit` set, sends beyond that many
+# per second are refused with 429 and a one second retry_after, like
+# Telegram's flood control.
+
+from telegram.request import BaseRequest
+
+class StandInTelegramRequest(BaseRequest):
+    def __init__(self, latency=0.05, session_setup=0.1, flood_limit=None):
+        self.latency = latency
+        self.session_setup = session_setup
+        self.flood_limit = flood_limit
+        self.sent = []
+        self.refused = 0
+        self._recent = []
+        self._loops = set()
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        if loop not in self._loops:
+            self._loops.add(loop)
+            await asyncio.sleep(self.session_setup)
+        await asyncio.sleep(self.latency)
+
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif self.flood_limit and self._flooded():
+            self.refused += 1
+            return 429, json.dumps({
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }).encode()
+        else:
+            self.sent.append(parameters.get("chat_id"))
+            result = {
+                "message_id": len(self.sent),
+                "date": 0,
+                "chat": {"id": parameters.get("chat_id"), "type": "group", "title": "Bench"},
+                "text": parameters.get("text", ""),
+            }
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def _flooded(self):
+        now = time.monotonic()
+        self._recent = [sent_at for sent_at in self._recent if now - sent_at < 1]
+        if len(self._recent) >= self.flood_limit:
+            return True
+        self._recent.append(now)
+        return False
@@ -0,0 +1,148 @@
+# Times how long the bot takes to start, each run in a fresh interpreter:
+# importing fitness_bot, building the application with its handlers, and
+# the first /viewtoday and /weekly against a fake sheet once it is up. The
+# Google client is timed on its own, as it is now built in the background
+# after start. --eager imports telegram.ext, apscheduler, the Google client
+# and NumPy before fitness_bot, as the bot used to, for comparison.
+#
+# Like command_flows, results can be saved and compared with an earlier run;
+# --compare exits with status 1 when a stage got slower than the tolerance.
+#
+#   python -m benchmarks.startup [--runs N] [--rows N] [--save FILE] [--compare FILE]
+
+# Only the standard library is imported here, so the child processes time
+# every other import themselves.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+STAGES = [
+    ("import", "import fitness_bot"),
+    ("build", "build the application"),
+    ("ready", "import and build"),
+    ("viewtoday", "first /viewtoday"),
+    ("weekly", "first /weekly"),
+    ("first_reply", "start to first reply"),
+    ("google", "Google client import"),
+]
+
+EAGER_MODULES = [
+    "telegram.ext",
+    "apscheduler.schedulers.asyncio",
+    "apscheduler.triggers.cron",
+    "googleapiclient.discovery",
+    "google.oauth2.service_account",
+    "google_auth_httplib2",
+    "numpy",
+]
+
+def child(eager, rows):
+    import asyncio
+    import importlib
+
+    start = time.perf_counter()
+    if eager:
+        for module in EAGER_MODULES:
+            importlib.import_module(module)
+    import fitness_bot
+    imported = time.perf_counter()
+    os.environ.setdefault("TELEGRAM_API_TOKEN", "1:stand-in")
+    fitness_bot.TELEGRAM_TOKEN = fitness_bot.TELEGRAM_TOKEN or os.environ["TELEGRAM_API_TOKEN"]
+    fitness_bot.build_application()
+    built = time.perf_counter()
+
+    # The stand-in sheet is not part of the bot, so setting it up is not
+    # timed.
+    from datetime import datetime
+    import pytz
+    from benchmarks import stand_in
+    from benchmarks.command_flows import FLOWS, run_flow, sheet
+    from fake_storage import FakeStorage
+    from scheduler import ScheduledStorage
+    today = datetime.now(pytz.timezone(fitness_bot.TIMEZONE)).strftime("%Y-%m-%d")
+
+    async def first_replies():
+        stand_in.use_storage(ScheduledStorage(FakeStorage(sheet(rows, today)), 0, 0))
+        viewtoday, _ = await run_flow(FLOWS["/viewtoday"], 0)
+        weekly, _ = await run_flow(FLOWS["/weekly"], 0)
+        return viewtoday, weekly
+    viewtoday, weekly = asyncio.run(first_replies())
+
+    import sheets
+    google_start = time.perf_counter()
+    sheets._load_google()
+    google = time.perf_counter() - google_start
+
+    print(json.dumps({
+        "import": imported - start,
+        "build": built - imported,
+        "ready": built - start,
+        "viewtoday": viewtoday,
+        "weekly": weekly,
+        "first_reply": built - start + viewtoday,
+        "google": google,
+    }))
+
+def measure(runs, rows, eager):
+    command = [sys.executable, "-m", "benchmarks.startup", "--child", "--rows", str(rows)]
+    if eager:
+        command.append("--eager")
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample["process"] = time.perf_counter() - start
+        samples.append(sample)
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+def compare(result, baseline, tolerance, min_change):
+    problems = []
+    for key, label in STAGES + [("process", "whole process")]:
+        before = baseline.get(key)
+        if before is None:
+            continue
+        if result[key] > before * (1 + tolerance) and result[key] - before > min_change:
+            problems.append(f"{label}: {result[key] * 1000:.0f} ms, was {before * 1000:.0f} ms")
+    return problems
+
+def run(options):
+    lazy = measure(options.runs, options.rows, eager=False)
+    eager = measure(options.runs, options.rows, eager=True)
+    print(f"Median of {options.runs} fresh processes, {options.rows:,} tracker rows")
+    print(f"{'stage':>24} | {'lazy':>8} | {'eager':>8}")
+    for key, label in STAGES + [("process", "whole process")]:
+        print(f"{label:>24} | {lazy[key] * 1000:>5.0f} ms | {eager[key] * 1000:>5.0f} ms")
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump({"options": vars(options), "result": lazy}, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            problems = compare(lazy, json.load(f)["result"], options.tolerance, options.min_change)
+        if problems:
+            print("\nRegressions:")
+            print("\n".join(problems))
+            return 1
+        print("\nNo regressions.")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the bot's start and first replies.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=1_000)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with results saved earlier")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed growth of a stage (default 0.25)")
+    parser.add_argument("--min-change", type=float, default=0.02, help="ignore growth below this many seconds")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--eager", action="store_true", help=argparse.SUPPRESS)
+    options = parser.parse_args()
+    if options.child:
+        child(options.eager, options.rows)
+    else:
+        sys.exit(run(options))
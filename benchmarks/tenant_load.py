@@ -0,0 +1,83 @@
+# Serves TENANTS chats from one process, each with its own fake sheet of
+# ROWS rows, and runs /viewtoday in all of them at once. Reports the cost of
+# the per-update tenant lookup, the memory each tenant adds once used, the
+# command times and that no chat saw another chat's rows.
+#
+#   python -m benchmarks.tenant_load [TENANTS] [ROWS] [LATENCY]
+
+from datetime import datetime
+import asyncio
+import sys
+import time
+import tracemalloc
+
+import pytz
+
+import fitness_bot
+import tenants
+from benchmarks import stand_in
+from benchmarks.cell_writes import tracker_rows
+from fake_storage import FakeStorage
+from reminders import _percentile
+from scheduler import Budget, ScheduledStorage
+
+LOOKUPS = 100_000
+
+async def view_today(tenant):
+    # What select_tenant does for an update, then the command itself.
+    tenants.use(fitness_bot.tenant_registry.get(tenant))
+    replies = []
+    start = time.perf_counter()
+    await fitness_bot.view_today(stand_in.message_update(replies), stand_in.context())
+    return time.perf_counter() - start, replies
+
+async def run(count, rows, latency):
+    today = datetime.now(pytz.timezone(fitness_bot.TIMEZONE)).strftime("%Y-%m-%d")
+    shared = Budget(0, 0)
+
+    # The fake sheets stand for the spreadsheets, so they are made before
+    # memory is traced.
+    backends = {}
+    for chat_id in range(count):
+        data = tracker_rows(rows, today)
+        data[-1][1] = f"Chat {chat_id}"  # today's row names its chat
+        backends[chat_id] = FakeStorage({"Daily Tracker": data}, latency)
+
+    def make_tenant(tenant):
+        backend = ScheduledStorage(backends[tenant.chat_id], 0, 0, shared=shared)
+        return fitness_bot.make_tenant(tenant, backend)
+
+    registry = fitness_bot.tenant_registry = tenants.TenantRegistry(make_tenant)
+    for chat_id in range(count):
+        registry.add(chat_id, f"sheet-{chat_id}")
+
+    # Every tenant is built by its first command.
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await asyncio.gather(*(view_today(chat_id) for chat_id in range(count)))
+    per_tenant = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for i in range(LOOKUPS):
+        registry.get(i % count)
+    lookup = (time.perf_counter() - start) / LOOKUPS
+
+    results = await asyncio.gather(*(view_today(chat_id) for chat_id in range(count)))
+    timings = [seconds for seconds, _ in results]
+    mixed = sum(
+        1 for chat_id, (_, replies) in enumerate(results)
+        if not replies or f"Chat {chat_id}\n" not in replies[0]
+    )
+
+    print(f"{count} chats, {rows} rows each, {latency * 1000:g} ms per Sheets request")
+    print(f"  tenant lookup:        {lookup * 1e6:.2f} us per update")
+    print(f"  memory per tenant:    {per_tenant / 1024:,.1f} KB once used (index, caches, client)")
+    print(f"  /viewtoday p50 / p99: {_percentile(timings, 50) * 1000:.1f} / {_percentile(timings, 99) * 1000:.1f} ms")
+    print(f"  replies with another chat's rows or missing: {mixed}")
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+    asyncio.run(run(count, rows, latency))
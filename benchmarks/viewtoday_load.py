@@ -0,0 +1,47 @@
+# Load test for the async Sheets layer: fires N concurrent /viewtoday calls
+# against a stand-in service whose every request takes LATENCY seconds.
+# Before the Sheets calls moved off the event loop, N requests took about
+# N * LATENCY; now they overlap and finish in about
+# ceil(N / SHEETS_MAX_CONCURRENCY) * LATENCY.
+#
+#   python -m benchmarks.viewtoday_load [N] [LATENCY]
+
+from datetime import datetime
+import asyncio
+import math
+import sys
+import time
+
+import pytz
+
+import fitness_bot
+import sheets
+from benchmarks import stand_in
+from scheduler import ScheduledStorage
+from storage import SheetsStorage
+
+async def run(n, latency):
+    today = datetime.now(pytz.timezone(fitness_bot.TIMEZONE)).strftime("%Y-%m-%d")
+    rows = [["Date", "Name", "Steps"]] + [[today, f"Person {i}", str(i)] for i in range(20)]
+    sheets._service = stand_in.StandInService({"Daily Tracker": rows}, latency=latency)
+    stand_in.use_storage(ScheduledStorage(SheetsStorage(fitness_bot.SPREADSHEET_ID)))
+
+    replies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        fitness_bot.view_today(stand_in.message_update(replies), stand_in.context()) for _ in range(n)
+    ))
+    elapsed = time.perf_counter() - start
+
+    serial = n * latency
+    expected = math.ceil(n / sheets.MAX_CONCURRENCY) * latency
+    print(f"{n} concurrent /viewtoday, {latency:.2f}s per Sheets call, {sheets.MAX_CONCURRENCY} workers")
+    print(f"  elapsed:            {elapsed:.2f}s")
+    print(f"  serialized would be {serial:.2f}s")
+    print(f"  bounded ideal       {expected:.2f}s")
+    print(f"  replies:            {len(replies)}")
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    asyncio.run(run(n, latency))
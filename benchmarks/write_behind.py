@@ -0,0 +1,91 @@
+# Sends UPDATES /update commands, arriving a few milliseconds apart and
+# spread over a few people and columns, first writing straight to the sheet
+# and then with the write-behind journal, and reports the Sheets requests made, how long commands took to reply and how
+# long the flushes took. It also checks that a flush after a row was deleted
+# by hand still writes to the right rows.
+#
+#   python -m benchmarks.write_behind [UPDATES] [LATENCY]
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import fitness_bot
+from benchmarks import stand_in
+from reminders import _percentile
+from fake_storage import FakeStorage
+from write_behind import WriteBehindBuffer
+import tenants
+
+HEADERS = ["Date", "Name", "Steps", "Water", "Sleep", "Workout"]
+PEOPLE = 10
+GAP = 0.005  # seconds between commands arriving
+
+def commands(updates):
+    for number in range(updates):
+        yield f"Person {number % PEOPLE}", HEADERS[2 + number // PEOPLE % (len(HEADERS) - 2)], str(number)
+
+async def send_updates(updates):
+    latencies = []
+    for name, column, value in commands(updates):
+        ctx = stand_in.context(user_data={stand_in.CHAT_ID: {"name": name, "column": column}})
+        start = time.perf_counter()
+        await fitness_bot.update_value(stand_in.message_update([], value), ctx)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(GAP)
+    return latencies
+
+async def check_deleted_row(buffer, tab):
+    # After a row is deleted by hand the index is one row off below it; a
+    # flush must still write to the entry's own row, not the one after it.
+    del tab[1]
+    before = [list(row) for row in tab]
+    date, name = tab[1][:2]
+    buffer.enqueue(date, name, {"Steps": "after delete"})
+    await buffer.flush()
+    before[1][HEADERS.index("Steps")] = "after delete"
+    assert [row + [""] * (len(HEADERS) - len(row)) for row in tab] == [
+        row + [""] * (len(HEADERS) - len(row)) for row in before
+    ], "a journaled change went into the wrong row"
+
+def report(label, service, latencies, elapsed):
+    print(
+        f"{label:>13} | {service.calls:>8} | {_percentile(latencies, 50) * 1000:>8.1f} | "
+        f"{_percentile(latencies, 99) * 1000:>8.1f} | {elapsed:>8.2f}"
+    )
+
+async def run(updates, latency):
+    print(f"{'mode':>13} | {'requests':>8} | {'p50 ms':>8} | {'p99 ms':>8} | {'total s':>8}")
+
+    backend = stand_in.use_storage(FakeStorage({"Daily Tracker": [list(HEADERS)]}, latency))
+    start = time.perf_counter()
+    latencies = await send_updates(updates)
+    report("direct", backend.spreadsheet, latencies, time.perf_counter() - start)
+    expected = [row[1:] for row in backend.spreadsheet.tabs["Daily Tracker"]]
+
+    backend = stand_in.use_storage(FakeStorage({"Daily Tracker": [list(HEADERS)]}, latency))
+    with tempfile.TemporaryDirectory() as folder:
+        tenant = tenants.current()
+        buffer = tenant.write_behind = WriteBehindBuffer(
+            backend, tenant.tracker_index, os.path.join(folder, "journal.db"), interval=0.5
+        )
+        buffer.start()
+        start = time.perf_counter()
+        latencies = await send_updates(updates)
+        await buffer.stop()
+        report("write-behind", backend.spreadsheet, latencies, time.perf_counter() - start)
+        assert [row[1:] for row in backend.spreadsheet.tabs["Daily Tracker"]] == expected
+        await check_deleted_row(buffer, backend.spreadsheet.tabs["Daily Tracker"])
+
+    for flush in buffer.flushes:
+        print(
+            f"flush: {flush['entries']} journaled changes -> {flush['cells']} cells, "
+            f"{flush['new_rows']} new rows in {flush['requests']} requests, {flush['latency'] * 1000:.1f} ms"
+        )
+
+if __name__ == "__main__":
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    asyncio.run(run(updates, latency))
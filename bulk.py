@@ -0,0 +1,194 @@
+from datetime import date, datetime
+import csv
+import itertools
+import os
+import sheets
+
+# Bulk import and export of Daily Tracker rows. Files are read and written a
+# row at a time and the sheet is written CHUNK_ROWS rows at a time, so tens
+# of thousands of rows never sit in memory at once, and each chunk costs at
+# most two Sheets requests: one batch update for rows already in the sheet
+# and one append for new ones.
+
+CHUNK_ROWS = 5000
+
+def cell_text(value):
+    # Cells as Google Sheets returns them: strings, with whole numbers and
+    # dates written the way the bot writes them.
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d") if value.time() == datetime.min.time() else value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+def _csv_rows(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.reader(f):
+            yield [value.strip() for value in row]
+
+def _xlsx_rows(path, sheet_name):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("Reading .xlsx files needs openpyxl: pip install openpyxl")
+    # read_only streams the rows from the file instead of loading the workbook.
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name in workbook.sheetnames else workbook.worksheets[0]
+        for row in sheet.iter_rows(values_only=True):
+            yield [cell_text(value) for value in row]
+    finally:
+        workbook.close()
+
+def table_rows(path, sheet_name="Daily Tracker"):
+    # Rows of a .csv file, or of the sheet_name tab of an .xlsx file (the
+    # first tab if it has none), as lists of strings.
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return _csv_rows(path)
+    if extension == ".xlsx":
+        return _xlsx_rows(path, sheet_name)
+    raise ValueError("Only .csv and .xlsx files can be imported.")
+
+def valid_date(value):
+    # Dates are written as YYYY-MM-DD throughout the tracker.
+    try:
+        return len(value) == 10 and date.fromisoformat(value).isoformat() == value
+    except ValueError:
+        return False
+
+async def import_rows(rows, tracker_index, storage):
+    # Writes rows (an iterator of lists of strings, headers first) into the
+    # tracker. Rows are matched to the sheet by date and name; non-empty
+    # values overwrite the cells of rows already there and empty ones leave
+    # them as they are. Columns the tracker does not have are ignored.
+    # Returns counts of what was done and the dates and names written.
+    header_row = next(rows, None)
+    if not header_row:
+        raise ValueError("The file is empty.")
+    file_columns = {header: index for index, header in enumerate(header_row) if header}
+    if "Date" not in file_columns or "Name" not in file_columns:
+        raise ValueError("The first row must have 'Date' and 'Name' columns, as in the sample sheet.")
+
+    # The whole file is written by row number, so the index is rebuilt first
+    # in case rows were inserted or deleted by hand (one read of A:B).
+    await tracker_index.reload()
+    headers = tracker_index.headers
+    sheet_name = tracker_index.sheet_name
+    # (file column, tracker column) of every column the tracker has.
+    columns = [
+        (file_columns[header], index) for index, header in enumerate(headers[2:], 2) if header in file_columns
+    ]
+    result = {
+        "rows": 0,
+        "updated": 0,
+        "added": 0,
+        "skipped": 0,
+        "requests": 0,
+        "ignored_columns": [header for header in file_columns if header not in headers],
+        "dates": set(),
+        "names": set(),
+    }
+    date_column, name_column = file_columns["Date"], file_columns["Name"]
+
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        # Later rows for the same date and name win.
+        changes = {}
+        for row in chunk:
+            row = row + [""] * (len(header_row) - len(row))
+            if not any(row):
+                continue  # blank rows, as the sample sheet has
+            entry_date, name = row[date_column], row[name_column]
+            result["rows"] += 1
+            if not name or not valid_date(entry_date):
+                result["skipped"] += 1
+                continue
+            values = changes.setdefault((entry_date, name), {})
+            for file_index, column in columns:
+                if row[file_index]:
+                    values[column] = row[file_index]
+
+        data = []
+        new_rows = []
+        for (entry_date, name), values in changes.items():
+            result["dates"].add(entry_date)
+            result["names"].add(name)
+            row_number = tracker_index.rows.get((entry_date, name))
+            if row_number is None:
+                row = [entry_date, name] + [""] * (len(headers) - 2)
+                for column, value in values.items():
+                    row[column] = value
+                new_rows.append(row)
+                continue
+            result["updated"] += 1
+            # One range per run of adjacent columns, usually one per row.
+            for _, run in itertools.groupby(enumerate(sorted(values)), lambda item: item[1] - item[0]):
+                run = [column for _, column in run]
+                data.append({
+                    "range": sheets.a1_range(sheet_name, row_number, row_number, run[0], run[-1]),
+                    "values": [[values[column] for column in run]],
+                })
+
+        if data:
+            await storage.batch_update(data)
+            result["requests"] += 1
+        if new_rows:
+            updated_range = await storage.append(f"{sheet_name}!A1", new_rows)
+            tracker_index.record_append(updated_range, new_rows)
+            result["added"] += len(new_rows)
+            result["requests"] += 1
+    return result
+
+def _spans(row_numbers, size):
+    # Groups sorted row numbers into (first, last) spans of at most size rows.
+    first = last = None
+    for row_number in row_numbers:
+        if first is not None and row_number - first >= size:
+            yield first, last
+            first = None
+        if first is None:
+            first = row_number
+        last = row_number
+    if first is not None:
+        yield first, last
+
+async def export_rows(tracker_index, storage, path, first_date=None, last_date=None, name=None):
+    # Writes the tracker rows between first_date and last_date (both
+    # included, either may be None) of name (or everyone) to a CSV file at
+    # path, in sheet order. Only the spans holding matching rows are read,
+    # CHUNK_ROWS rows per request. Returns the number of rows written. The
+    # index is rebuilt first so rows moved by hand are not left out.
+    await tracker_index.reload()
+    wanted = sorted(
+        row_number for (entry_date, entry_name), row_number in tracker_index.rows.items()
+        if (first_date is None or entry_date >= first_date)
+        and (last_date is None or entry_date <= last_date)
+        and (name is None or entry_name == name)
+    )
+    headers = tracker_index.headers
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for first, last in _spans(wanted, CHUNK_ROWS):
+            values = await storage.read(tracker_index.row_range(first, last))
+            for row in values:
+                if len(row) < 2:
+                    continue
+                entry_date, entry_name = row[0], row[1]
+                if first_date is not None and entry_date < first_date:
+                    continue
+                if last_date is not None and entry_date > last_date:
+                    continue
+                if name is not None and entry_name != name:
+                    continue
+                writer.writerow(row + [""] * (len(headers) - len(row)))
+                count += 1
+    return count
@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+class ReferenceCache:
+    # Caches small, rarely changing ranges (People names, tracker headers)
+    # for `ttl` seconds. Commands that change them write the new value through
+    # with put(), so readers only go to Sheets after the TTL runs out.
+
+    def __init__(self, loader, ttl):
+        self.loader = loader
+        self.ttl = ttl
+        self._entries = {}
+        self._loading = {}
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self._stats["hits"] += 1
+            return entry[1]
+
+        self._stats["misses"] += 1
+        # Concurrent misses for the same key share one Sheets call.
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = self._loading[key] = asyncio.ensure_future(self._load(key))
+        return await asyncio.shield(loading)
+
+    async def _load(self, key):
+        try:
+            value = await self.loader(key)
+            self._entries[key] = (time.monotonic(), value)
+            return value
+        finally:
+            del self._loading[key]
+
+    def missing(self, keys):
+        # The keys a get() would have to load.
+        now = time.monotonic()
+        return [
+            key for key in keys
+            if key not in self._loading and (key not in self._entries or now - self._entries[key][0] >= self.ttl)
+        ]
+
+    def peek(self, key):
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None else None
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic(), value)
+
+    def invalidate(self, key=None):
+        self._stats["invalidations"] += 1
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        return dict(self._stats)
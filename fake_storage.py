@@ -0,0 +1,227 @@
+from collections import deque
+import asyncio
+import json
+import re
+import time
+from storage import Storage
+
+# An in-process stand-in for Google Sheets, for running and benchmarking the
+# bot without network access. FakeSpreadsheet keeps the tabs in memory and
+# follows the values API closely enough for the bot: A1 ranges (open ended,
+# whole rows or columns, quoted tab names), trailing empty cells and rows left
+# out of reads, appends landing after the last row with data, 26-column grids
+# that have to be grown before writing further right, and 400 errors for
+# unknown tabs. It also models latency (latency + bytes / bandwidth) and
+# per-minute read and write quotas, answering 429 like Sheets does once one
+# runs out.
+
+_CELL = re.compile(r"^\$?([A-Za-z]*)\$?(\d*)$")
+
+def column_index(letters):
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+def column_letters(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+def parse_range(range):
+    # Returns (tab, first_row, last_row, first_column, last_column), 0-based
+    # and inclusive, with None for an open end.
+    tab, _, cells = range.rpartition("!")
+    if not tab:
+        tab, cells = cells, ""
+    start, _, end = cells.partition(":")
+    if not end:
+        end = start
+    start_column, start_row = _CELL.match(start).groups()
+    end_column, end_row = _CELL.match(end).groups()
+    return (
+        tab.strip("'").replace("''", "'"),
+        int(start_row) - 1 if start_row else 0,
+        int(end_row) - 1 if end_row else None,
+        column_index(start_column) if start_column else 0,
+        column_index(end_column) if end_column else None,
+    )
+
+def quote(tab):
+    return tab if tab.isalnum() else "'" + tab.replace("'", "''") + "'"
+
+def http_error(status, message):
+    # Imported here, so using the fake does not import the Google client
+    # until a request is refused.
+    from googleapiclient.errors import HttpError
+    import httplib2
+    content = json.dumps({"error": {"code": status, "message": message}}).encode()
+    return HttpError(httplib2.Response({"status": status}), content)
+
+class FakeSpreadsheet:
+    def __init__(self, tabs=None, latency=0.0, bandwidth=0.0, reads_per_minute=None, writes_per_minute=None, window=60.0):
+        # window is the length of a quota "minute" in seconds, shortened by
+        # benchmarks that do not want to wait whole minutes.
+        self.window = window
+        self.tabs = {title: [list(row) for row in rows] for title, rows in (tabs or {}).items()}
+        # Tabs are at least as wide as their data, as in Google Sheets. Writes
+        # never go past the grid, so it is only measured here.
+        self.column_counts = {
+            title: max([26] + [len(row) for row in rows]) for title, rows in self.tabs.items()
+        }
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.quotas = {"read": reads_per_minute, "write": writes_per_minute}
+        self._recent = {"read": deque(), "write": deque()}
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.calls = 0
+        self.rejected = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def request(self, kind, body, run):
+        # Runs one API request of kind "read" or "write". Returns its result
+        # and how long it would have taken over the network.
+        self._check_quota(kind)
+        result = run()
+        sent = len(json.dumps(body)) if body is not None else 0
+        received = len(json.dumps(result))
+        self.calls += 1
+        self.bytes_sent += sent
+        self.bytes_received += received
+        return result, self.delay(sent + received)
+
+    def delay(self, size=0):
+        return self.latency + (size / self.bandwidth if self.bandwidth else 0.0)
+
+    def _check_quota(self, kind):
+        limit = self.quotas[kind]
+        if not limit:
+            return
+        now = time.monotonic()
+        recent = self._recent[kind]
+        while recent and now - recent[0] >= self.window:
+            recent.popleft()
+        if len(recent) >= limit:
+            self.rejected += 1
+            raise http_error(429, f"Quota exceeded for quota metric '{kind.title()} requests' per minute.")
+        recent.append(now)
+
+    def _rows(self, tab):
+        if tab not in self.tabs:
+            raise http_error(400, f"Unable to parse range: {tab}")
+        return self.tabs[tab]
+
+    def column_count(self, tab):
+        return self.column_counts.get(tab, 26)
+
+    def read(self, range):
+        tab, first_row, last_row, first_column, last_column = parse_range(range)
+        rows = self._rows(tab)[first_row:None if last_row is None else last_row + 1]
+        values = []
+        for row in rows:
+            row = row[first_column:None if last_column is None else last_column + 1]
+            while row and row[-1] == "":
+                row = row[:-1]
+            values.append(list(row))
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def check_write(self, range, values):
+        tab, _, _, first_column, _ = parse_range(range)
+        self._rows(tab)
+        if values and first_column + max(len(row) for row in values) > self.column_count(tab):
+            raise http_error(400, f"Range ({range}) exceeds grid limits. Max columns: {self.column_count(tab)}")
+
+    def write(self, range, values):
+        self.check_write(range, values)
+        tab, first_row, _, first_column, _ = parse_range(range)
+        rows = self.tabs[tab]
+        for offset, new_values in enumerate(values):
+            row_number = first_row + offset
+            while len(rows) <= row_number:
+                rows.append([])
+            row = rows[row_number]
+            row.extend([""] * (first_column + len(new_values) - len(row)))
+            row[first_column:first_column + len(new_values)] = [str(value) for value in new_values]
+
+    def append(self, range, values):
+        tab, _, _, first_column, _ = parse_range(range)
+        rows = self._rows(tab)
+        start = len(rows)
+        while start and not any(rows[start - 1]):
+            start -= 1
+        width = max((len(row) for row in values), default=1)
+        updated_range = (
+            f"{quote(tab)}!{column_letters(first_column)}{start + 1}:"
+            f"{column_letters(first_column + width - 1)}{start + len(values)}"
+        )
+        self.write(updated_range, values)
+        return updated_range
+
+    def sheets(self):
+        return [
+            {"properties": {
+                "sheetId": sheet_id,
+                "title": title,
+                "gridProperties": {"rowCount": max(1000, len(rows)), "columnCount": self.column_count(title)},
+            }}
+            for sheet_id, (title, rows) in enumerate(self.tabs.items())
+        ]
+
+    def append_columns(self, tab, length):
+        self._rows(tab)
+        self.column_counts[tab] = self.column_count(tab) + length
+
+class FakeStorage(Storage):
+    def __init__(self, tabs=None, latency=0.0, bandwidth=0.0, reads_per_minute=None, writes_per_minute=None, window=60.0):
+        super().__init__()
+        self.spreadsheet = FakeSpreadsheet(tabs, latency, bandwidth, reads_per_minute, writes_per_minute, window)
+
+    async def _request(self, kind, body, run):
+        try:
+            result, delay = self.spreadsheet.request(kind, body, run)
+        except Exception as e:
+            # A refused request still takes a round trip.
+            from googleapiclient.errors import HttpError
+            if isinstance(e, HttpError):
+                await asyncio.sleep(self.spreadsheet.delay())
+            raise
+        if delay:
+            await asyncio.sleep(delay)
+        return result
+
+    async def read(self, range):
+        return await self._request("read", None, lambda: self.spreadsheet.read(range))
+
+    async def read_many(self, ranges):
+        return await self._request("read", None, lambda: [self.spreadsheet.read(range) for range in ranges])
+
+    async def sheet_titles(self):
+        return await self._request("read", None, lambda: list(self.spreadsheet.tabs))
+
+    async def ensure_column_count(self, sheet_name, count):
+        missing = count - await self._request("read", None, lambda: self.spreadsheet.column_count(sheet_name))
+        if missing > 0:
+            await self._request("write", None, lambda: self.spreadsheet.append_columns(sheet_name, missing))
+
+    async def _update(self, range, values):
+        await self._request("write", {"values": values}, lambda: self.spreadsheet.write(range, values))
+
+    async def _append(self, range, values):
+        return await self._request("write", {"values": values}, lambda: self.spreadsheet.append(range, values))
+
+    async def _batch_update(self, data):
+        def run():
+            # Sheets checks the whole batch before writing any of it.
+            for entry in data:
+                self.spreadsheet.check_write(entry["range"], entry["values"])
+            for entry in data:
+                self.spreadsheet.write(entry["range"], entry["values"])
+        await self._request("write", {"data": data}, run)
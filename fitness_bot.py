@@ -1,15 +1,41 @@
+from __future__ import annotations
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, ConversationHandler, MessageHandler, filters
-from googleapiclient.discovery import build
-from google.oauth2.service_account import Credentials
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
 from datetime import datetime
+from urllib.parse import urlparse
+import asyncio
 import os
+import re
+import signal
+import tempfile
 from functools import wraps
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
 import pytz
-import asyncio
+import bulk
+import sheets
+from storage import SheetsStorage
+from scheduler import Budget, ScheduledStorage
+from tracker import TrackerIndex
+from cache import ReferenceCache
+from weekly import WeeklyStats
+from reminders import Broadcaster, ReminderStore, SLOTS, _percentile, slot_job_id
+from write_behind import WriteBehindBuffer
+from mirror import SheetMirror
+from keyboards import KeyboardCache
+from metrics import metrics
+from tenants import TenantRegistry, known_timezone
+import tenants
+from render import PageCache, entry_blocks, page_keyboard, paginate
+
+# telegram.ext (which brings in tornado), apscheduler and the Google client
+# take most of the time to start the bot, and the handlers do not need them
+# to run, so they are imported when the application is built and the first
+# Sheets request is made. Tests and benchmarks importing this module skip
+# them entirely.
+if TYPE_CHECKING:
+    from telegram.ext import Application, ContextTypes
+
+END = -1  # ConversationHandler.END
 
 load_dotenv()
 
@@ -18,19 +44,296 @@ CREDENTIALS_FILE = os.getenv('CREDENTIALS_FILE')
 SPREADSHEET_ID = os.getenv('GOOGLE_SHEET_ID')
 ADMIN_ID = os.getenv('ADMIN_ID')
 TIMEZONE = os.getenv('TIMEZONE')
-if TIMEZONE is None or TIMEZONE == "" or TIMEZONE not in pytz.all_timezones:
+REFERENCE_CACHE_TTL = float(os.getenv('REFERENCE_CACHE_TTL') or 300)
+WEEKLY_STATS_WEEKS = int(os.getenv('WEEKLY_STATS_WEEKS') or 4)
+WEEKLY_STATS_TTL = float(os.getenv('WEEKLY_STATS_TTL') or 60)
+REMINDERS_DB = os.getenv('REMINDERS_DB') or "reminders.db"
+REMINDER_RATE = float(os.getenv('REMINDER_RATE') or 30)
+REMINDER_SPREAD_SECONDS = float(os.getenv('REMINDER_SPREAD_SECONDS') or 60)
+WRITE_BEHIND = os.getenv('WRITE_BEHIND', '').lower() in ("1", "true", "yes")
+WRITE_BEHIND_JOURNAL = os.getenv('WRITE_BEHIND_JOURNAL') or "write_behind.db"
+WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL') or 5)
+CONVERSATION_TIMEOUT = float(os.getenv('CONVERSATION_TIMEOUT') or 600)
+SHEETS_READS_PER_MINUTE = int(os.getenv('SHEETS_READS_PER_MINUTE') or 60)
+SHEETS_WRITES_PER_MINUTE = int(os.getenv('SHEETS_WRITES_PER_MINUTE') or 60)
+TENANT_READS_PER_MINUTE = int(os.getenv('TENANT_READS_PER_MINUTE') or SHEETS_READS_PER_MINUTE)
+TENANT_WRITES_PER_MINUTE = int(os.getenv('TENANT_WRITES_PER_MINUTE') or SHEETS_WRITES_PER_MINUTE)
+TENANTS_FILE = os.getenv('TENANTS_FILE')
+METRICS = os.getenv('METRICS', '').lower() in ("1", "true", "yes")
+METRICS_PORT = int(os.getenv('METRICS_PORT') or 0)
+SHEET_MIRROR = os.getenv('SHEET_MIRROR', '').lower() in ("1", "true", "yes")
+SHEET_MIRROR_DB = os.getenv('SHEET_MIRROR_DB') or "mirror.db"
+SHEET_MIRROR_INTERVAL = float(os.getenv('SHEET_MIRROR_INTERVAL') or 30)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN') or "0.0.0.0"
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT') or 8443)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS') or 8)
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT') or 30)
+if TIMEZONE is None or TIMEZONE == "" or not known_timezone(TIMEZONE):
     TIMEZONE = "UTC"
-scheduler = BackgroundScheduler(timezone=pytz.timezone(TIMEZONE))
-scheduler.start()
+scheduler = None  # started in post_init
+reminder_store = None  # opened in post_init
+broadcaster = Broadcaster(rate=REMINDER_RATE, spread=REMINDER_SPREAD_SECONDS)
+# Google counts Sheets requests per user, and every tenant uses the same
+# service account, so their budgets come out of this one.
+sheets_budget = Budget(SHEETS_READS_PER_MINUTE, SHEETS_WRITES_PER_MINUTE)
+update_processor = None  # made in build_application
+
+def tenant_path(path, tenant):
+    # The chat set up in .env keeps its file names; other tenants get their
+    # own files next to them.
+    if str(tenant.chat_id) == str(ADMIN_ID):
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}-{tenant.chat_id}{extension}"
+
+def invalidate_weeks(tenant, dates):
+    for date in dates:
+        tenant.weekly_stats_engine.invalidate(date)
+
+def make_tenant(tenant, storage=None):
+    # Gives a tenant its own Sheets client, budget, index and caches.
+    tenant.storage = storage or ScheduledStorage(
+        SheetsStorage(tenant.spreadsheet_id), TENANT_READS_PER_MINUTE, TENANT_WRITES_PER_MINUTE, shared=sheets_budget
+    )
+    tenant.tracker_index = TrackerIndex(tenant.storage)
+    tenant.mirror = None
+    if SHEET_MIRROR:
+        tenant.mirror = SheetMirror(tenant.storage, tenant_path(SHEET_MIRROR_DB, tenant), SHEET_MIRROR_INTERVAL)
+    tenant.weekly_stats_engine = WeeklyStats(tenant.tracker_index, tenant.mirror, WEEKLY_STATS_TTL)
+    tenant.reference_cache = ReferenceCache(tenant.storage.read, REFERENCE_CACHE_TTL)
+    tenant.keyboard_cache = KeyboardCache()
+    tenant.page_cache = PageCache()
+    tenant.write_behind = None
+    if WRITE_BEHIND:
+        tenant.write_behind = WriteBehindBuffer(
+            tenant.storage, tenant.tracker_index, tenant_path(WRITE_BEHIND_JOURNAL, tenant), WRITE_BEHIND_INTERVAL,
+            on_flush=lambda dates: invalidate_weeks(tenant, dates),
+        )
+    return tenant
 
-def get_sheet_service():
-    credentials = Credentials.from_service_account_file(CREDENTIALS_FILE)
-    return build('sheets', 'v4', credentials=credentials).spreadsheets()
+tenant_registry = TenantRegistry(make_tenant)
+if ADMIN_ID and SPREADSHEET_ID and ADMIN_ID.lstrip("-").isdigit():
+    tenant_registry.add(int(ADMIN_ID), SPREADSHEET_ID, TIMEZONE)
+if TENANTS_FILE:
+    tenant_registry.load(TENANTS_FILE)
 
-def ensure_sheet_data(sheet, range):
-    data = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range=range).execute().get('values', [])
+async def ensure_sheet_data(range):
+    data = await tenants.current().storage.read(range)
     return data if data else [[]]
 
+metrics.enabled = METRICS
+
+def add_up(stats):
+    total = {}
+    for each in stats:
+        for key, value in each.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+def component_stats():
+    # Counters of all tenants that have been used, added up.
+    built = tenant_registry.built()
+    sections = {
+        "Sheets client": sheets.get_stats(),
+        "Sheets scheduler": add_up(tenant.storage.stats for tenant in built),
+        "Reference cache": add_up(tenant.reference_cache.stats() for tenant in built),
+        "Keyboards": add_up(tenant.keyboard_cache.stats for tenant in built),
+        "Updates": update_processor.status() if update_processor else {},
+        "Tenants": {"configured": len(tenant_registry), "active": len(built)},
+    }
+    mirrors = [tenant.mirror for tenant in built if tenant.mirror]
+    if mirrors:
+        sections["Local copy"] = add_up(mirror.stats for mirror in mirrors)
+    journals = [tenant.write_behind for tenant in built if tenant.write_behind]
+    if journals:
+        # Flush sizes and latencies are of the last flushes each journal
+        # keeps (50), so they follow recent load.
+        flushes = [flush for journal in journals for flush in journal.flushes]
+        sections["Write-behind"] = {
+            "pending": sum(journal.pending_count() for journal in journals),
+            "flushes": len(flushes),
+        }
+        if flushes:
+            sizes = [flush["entries"] for flush in flushes]
+            latencies = [flush["latency"] for flush in flushes]
+            last = max((journal.flushes[-1] for journal in journals if journal.flushes), key=lambda flush: flush["finished"])
+            sections["Write-behind"].update({
+                "flush_entries_p50": _percentile(sizes, 50),
+                "flush_entries_max": max(sizes),
+                "flush_latency_p50": _percentile(latencies, 50),
+                "flush_latency_max": max(latencies),
+            })
+            sections["Last write-behind flush"] = {
+                key: last[key] for key in ("entries", "cells", "new_rows", "requests", "latency")
+            }
+    if broadcaster.runs:
+        last = broadcaster.runs[-1]
+        sections["Last reminder run"] = {
+            key: last[key] for key in ("chats", "delivered", "failed", "duration", "latency_p99")
+        }
+    return sections
+
+metrics.add_collector(component_stats)
+
+
+async def reply_pages(message, header, blocks, separator="\n"):
+    # Sends header and blocks, split into pages that fit in a Telegram
+    # message. Further pages are shown through the buttons under the first.
+    tenant = tenants.current()
+    pages = list(paginate(header, blocks, separator))
+    if len(pages) == 1:
+        await message.reply_text(pages[0])
+        return
+    key = tenant.page_cache.put(pages)
+    await message.reply_text(pages[0], reply_markup=page_keyboard(key, 0, len(pages)))
+
+async def handle_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenants.current()
+    query = update.callback_query
+    _, key, number = query.data.split(":")
+    pages = tenant.page_cache.get(key)
+    if pages is None:
+        await query.answer("This list has expired. Please run the command again.")
+        return
+    await query.answer()
+    number = int(number)
+    if number < len(pages) and pages[number] != query.message.text:
+        await query.edit_message_text(pages[number], reply_markup=page_keyboard(key, number, len(pages)))
+
+KEYBOARD_PREFIXES = {"people": "", "weekly": "weekly_", "goals": "viewgoals_", "columns": ""}
+
+async def keyboard_options(kind):
+    if kind == "columns":
+        return (await get_headers())[2:]
+    return [row[0] for row in await get_people() if len(row) > 0]
+
+async def reply_keyboard(message, kind, text, search=""):
+    # Sends text with a button per person (or column), a page at a time and
+    # narrowed down to the names matching search. Returns False when nothing
+    # matches.
+    tenant = tenants.current()
+    markup, count = tenant.keyboard_cache.markup(kind, await keyboard_options(kind), KEYBOARD_PREFIXES[kind], search)
+    if not count:
+        await message.reply_text(f"No names match '{search}'.")
+        return False
+    await message.reply_text(text, reply_markup=markup)
+    return True
+
+async def handle_keyboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Prev/Next under a name or column keyboard.
+    tenant = tenants.current()
+    query = update.callback_query
+    await query.answer()
+    _, kind, page, search = query.data.split(":", 3)
+    if kind not in KEYBOARD_PREFIXES:
+        return
+    markup, _ = tenant.keyboard_cache.markup(kind, await keyboard_options(kind), KEYBOARD_PREFIXES[kind], search, int(page))
+    if markup != query.message.reply_markup:
+        await query.edit_message_reply_markup(markup)
+
+def use_mirror():
+    # Reads come from the local copy once it has been filled.
+    tenant = tenants.current()
+    return tenant.mirror is not None and tenant.mirror.ready()
+
+async def get_people():
+    tenant = tenants.current()
+    if use_mirror():
+        return [row[:1] for row in tenant.mirror.rows("People")]
+    return await tenant.reference_cache.get("People!A1:A")
+
+async def get_headers():
+    tenant = tenants.current()
+    if use_mirror():
+        headers = tenant.mirror.headers()
+    else:
+        rows = await tenant.reference_cache.get("Daily Tracker!1:1")
+        headers = rows[0] if rows else []
+    if headers != tenant.tracker_index.headers:
+        tenant.tracker_index.set_headers(headers)
+    return headers
+
+GOAL_HEADERS = ["Name", "Goal Name", "Description"]
+GOAL_NAMES_RANGE = sheets.a1_range("Goals", 1, None, 0, 1)
+
+async def get_goal_headers():
+    tenant = tenants.current()
+    if use_mirror():
+        return tenant.mirror.headers("Goals")
+    rows = await tenant.reference_cache.get("Goals!1:1")
+    return rows[0] if rows else []
+
+async def read_goals(last_column=None):
+    # Reads the Goals tab up to its last header, or only up to last_column
+    # when a command needs fewer columns.
+    tenant = tenants.current()
+    if use_mirror():
+        return tenant.mirror.rows("Goals")
+    if last_column is None:
+        headers = await get_goal_headers()
+        range = sheets.width_range("Goals", headers, minimum_width=len(GOAL_HEADERS))
+    else:
+        range = sheets.a1_range("Goals", 1, None, 0, last_column)
+    return await tenant.storage.read(range)
+
+async def prefetch(update, context, cached=(), ranges=()):
+    # Reads everything a conversation will need in one batchGet when it
+    # starts: the reference ranges in `cached` that are not cached yet, and
+    # `ranges`, which later steps take with take_prefetched().
+    tenant = tenants.current()
+    if use_mirror():
+        return
+    cached = tenant.reference_cache.missing(cached)
+    if not cached and not ranges:
+        return
+    results = await tenant.storage.read_many(cached + list(ranges))
+    for key, values in zip(cached, results):
+        tenant.reference_cache.put(key, values)
+    if ranges:
+        conversation(update, context)["prefetched"] = dict(zip(ranges, results[len(cached):]))
+
+def take_prefetched(update, context, range):
+    # Values read for range when the conversation started, or None. Each is
+    # used once, so later steps read Sheets again.
+    return conversation(update, context).get("prefetched", {}).pop(range, None)
+
+# Keys each conversation keeps in its chat's state while it is open. They are removed
+# when the conversation ends, is cancelled or times out.
+UPDATE_KEYS = ("name", "column")
+GOAL_KEYS = ("person_name", "goal_name", "goal_rows", "prefetched")
+BATCH_KEYS = ("batch",)
+CONVERSATION_KEYS = UPDATE_KEYS + GOAL_KEYS + BATCH_KEYS
+
+def conversation(update, context):
+    # The state of the conversation the user has open in this chat. The same
+    # person can use the bot in several of the chats it serves, so user_data
+    # holds one dict per chat instead of the keys themselves.
+    return context.user_data.setdefault(update.effective_chat.id, {})
+
+def end_conversation(update, context, keys=CONVERSATION_KEYS):
+    chat_id = update.effective_chat.id
+    state = context.user_data.get(chat_id, {})
+    for key in keys:
+        state.pop(key, None)
+    if not state:
+        context.user_data.pop(chat_id, None)
+    if not context.user_data and update.effective_user:
+        context.application.drop_user_data(update.effective_user.id)
+    return END
+
+def conversation_timeout(command, keys):
+    async def timed_out(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        end_conversation(update, context, keys)
+        if update.effective_message:
+            await update.effective_message.reply_text(f"No reply for a while, so /{command} was cancelled.")
+    return timed_out
+
+async def conversation_expired(update, context, command):
+    await update.effective_message.reply_text(f"This conversation has expired. Please start again with /{command}.")
+    return end_conversation(update, context, ())
+
 SELECT_NAME, SELECT_COLUMN, UPDATE_VALUE = range(3)
 
 async def get_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -42,55 +345,46 @@ async def get_user_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return
 
 async def update_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    service = get_sheet_service()
-    sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="People!A1:A").execute()
-    people_data = sheet.get('values', [])
+    await prefetch(update, context, cached=["People!A1:A", "Daily Tracker!1:1"])
+    people_data = await get_people()
 
     if not people_data:
         await update.message.reply_text("No names found in the People sheet. Please add names first.")
-        return ConversationHandler.END
-
-    names = [name[0] for name in people_data if len(name) > 0]
+        return END
 
-    keyboard = [[InlineKeyboardButton(name, callback_data=name)] for name in names]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Select the name:", reply_markup=reply_markup)
+    if not await reply_keyboard(update.message, "people", "Select the name:", ' '.join(context.args)):
+        return end_conversation(update, context, UPDATE_KEYS)
     return SELECT_NAME
 
 async def select_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    context.user_data["name"] = query.data
+    conversation(update, context)["name"] = query.data
 
-    service = get_sheet_service()
-    sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="Daily Tracker!1:1").execute()
-    headers = sheet.get('values', [[]])[0]
+    headers = await get_headers()
 
     if not headers:
         await query.message.reply_text("No columns found. Please add headers first.")
-        return ConversationHandler.END
+        return end_conversation(update, context, UPDATE_KEYS)
 
-    keyboard = [
-        [InlineKeyboardButton(f"{header}", callback_data=header)] for header in headers[2:]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.message.reply_text("Select the column:", reply_markup=reply_markup)
+    await reply_keyboard(query.message, "columns", "Select the column:")
     return SELECT_COLUMN
 
 async def select_column(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenants.current()
     query = update.callback_query
     await query.answer()
-    context.user_data["column"] = query.data
-
-    service = get_sheet_service()
-    today_date = datetime.now(pytz.timezone(TIMEZONE)).strftime("%Y-%m-%d")
-    sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="Daily Tracker!A1:Z").execute()
-    data = sheet.get('values', [])
-    headers = data[0]
-    column_index = headers.index(query.data)
-    name = context.user_data["name"]
-
-    row = next((row for row in data[1:] if len(row) > 1 and row[0] == today_date and row[1] == name), None)
+    state = conversation(update, context)
+    if "name" not in state:
+        return await conversation_expired(update, context, "update")
+    state["column"] = query.data
+
+    today_date = datetime.now(pytz.timezone(tenant.timezone)).strftime("%Y-%m-%d")
+    name = state["name"]
+    column_index = tenant.tracker_index.columns[query.data]
+    _, row = await tenant.tracker_index.get_row(today_date, name, last_column=column_index)
+    if tenant.write_behind:
+        row = tenant.write_behind.apply(tenant.tracker_index.headers, row or [today_date, name])
     current_value = row[column_index] if row and len(row) > column_index else "None"
 
     await query.message.reply_text(
@@ -99,160 +393,150 @@ async def select_column(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return UPDATE_VALUE
 
 async def update_value(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenants.current()
     new_value = update.message.text
-    name = context.user_data["name"]
-    column = context.user_data["column"]
-
-    service = get_sheet_service()
-    sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="Daily Tracker!A1:Z").execute()
-    data = sheet.get('values', [])
-    headers = data[0]
-    column_index = headers.index(column)
-    today_date = datetime.now(pytz.timezone(TIMEZONE)).strftime("%Y-%m-%d")
-
-    row_index = next((i for i, row in enumerate(data) if len(row) > 1 and row[0] == today_date and row[1] == name), None)
-    if row_index is None:
-        new_row = [today_date, name] + [""] * (len(headers) - 2)
-        data.append(new_row)
-        row_index = len(data) - 1
-
-    while len(data[row_index]) < len(headers):
-        data[row_index].append("")
-
-    data[row_index][column_index] = new_value
-    service.values().update(
-        spreadsheetId=SPREADSHEET_ID,
-        range="Daily Tracker!A1:Z",
-        valueInputOption="RAW",
-        body={"values": data}
-    ).execute()
+    state = conversation(update, context)
+    if "name" not in state or "column" not in state:
+        return await conversation_expired(update, context, "update")
+    name = state["name"]
+    column = state["column"]
+
+    today_date = datetime.now(pytz.timezone(tenant.timezone)).strftime("%Y-%m-%d")
+    if tenant.write_behind:
+        # Journaled now, written to Sheets by the next flush.
+        tenant.write_behind.enqueue(today_date, name, {column: new_value})
+        await update.message.reply_text(
+            f"Updated {name}'s {column} to {new_value} for {today_date}."
+        )
+        return end_conversation(update, context, UPDATE_KEYS)
+
+    # The lock stops two concurrent /update commands from both appending
+    # today's row for the same person.
+    async with tenant.tracker_index.row_lock(today_date, name):
+        row_number, _ = await tenant.tracker_index.get_row(today_date, name, last_column=1)
+        headers = tenant.tracker_index.headers
+        column_index = tenant.tracker_index.columns[column]
+
+        if row_number is None:
+            new_row = [today_date, name] + [""] * (len(headers) - 2)
+            new_row[column_index] = new_value
+            updated_range = await tenant.storage.append("Daily Tracker!A1", [new_row])
+            tenant.tracker_index.record_append(updated_range, [new_row])
+        else:
+            await tenant.storage.update(sheets.cell("Daily Tracker", row_number, column_index), [[new_value]])
+            tenant.weekly_stats_engine.invalidate(today_date)
 
     await update.message.reply_text(
         f"Updated {name}'s {column} to {new_value} for {today_date}."
     )
-    return ConversationHandler.END
+    return end_conversation(update, context, UPDATE_KEYS)
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Update cancelled.")
-    return ConversationHandler.END
+    return END
 
 async def add_new_person(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenants.current()
     try:
         args = ' '.join(context.args)
         if not args:
             await update.message.reply_text("Usage: /addnewperson <name>")
             return
-        service = get_sheet_service()
-        service.values().append(
-            spreadsheetId=SPREADSHEET_ID,
-            range="People!A1",
-            valueInputOption="RAW",
-            body={"values": [[args]]}
-        ).execute()
+        await tenant.storage.append("People!A1", [[args]])
+        people_data = tenant.reference_cache.peek("People!A1:A")
+        if people_data is not None:
+            tenant.reference_cache.put("People!A1:A", people_data + [[args]])
         await update.message.reply_text(f"Added new person: {args}")
     except Exception as e:
         await update.message.reply_text(f"Error: {e}")
 
 async def view_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenants.current()
     try:
-        service = get_sheet_service()
-        sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="Daily Tracker!A1:Z").execute()
-        data = sheet.get('values', [])
-        
-        today_date = datetime.now(pytz.timezone(TIMEZONE)).strftime("%Y-%m-%d")
-        
-        if not data or len(data) < 2:
-            await update.message.reply_text("No entries found for today.")
-            return
-
-        headers = data[0]
-        today_entries = [dict(zip(headers, row)) for row in data[1:] if len(row) > 0 and row[0] == today_date]
-        
-        if not today_entries:
+        today_date = datetime.now(pytz.timezone(tenant.timezone)).strftime("%Y-%m-%d")
+        if use_mirror():
+            rows = tenant.mirror.rows_for_dates([today_date])
+            headers = tenant.mirror.headers()
+        else:
+            rows = await tenant.tracker_index.rows_for_date(today_date)
+            headers = tenant.tracker_index.headers
+        if tenant.write_behind:
+            rows = tenant.write_behind.overlay(headers, rows, today_date)
+        if not rows:
             await update.message.reply_text("No entries found for today.")
             return
 
-        response = "Today's Entries:\n"
-        for entry in today_entries:
-            response += "\n".join(f"{key}: {value}" for key, value in entry.items() if value)
-            response += "\n---\n"
-
-        await update.message.reply_text(response.strip())
+        await reply_pages(update.message, "Today's Entries:", entry_blocks(dict(zip(headers, row)) for row in rows))
     except Exception as e:
         await update.message.reply_text(f"Error: {e}")
 
 async def add_columns(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenants.current()
     try:
         column_name = ' '.join(context.args)
         if not column_name:
             await update.message.reply_text("Usage: /addcolumns <column name>")
             return
 
-        service = get_sheet_service()
-        headers = ensure_sheet_data(service, "Daily Tracker!1:1")[0]
+        headers = (await ensure_sheet_data("Daily Tracker!1:1"))[0]
         headers.append(column_name)
 
-        service.values().update(
-            spreadsheetId=SPREADSHEET_ID,
-            range="Daily Tracker!1:1",
-            valueInputOption="RAW",
-            body={"values": [headers]}
-        ).execute()
+        await tenant.storage.ensure_column_count("Daily Tracker", len(headers))
+        await tenant.storage.update("Daily Tracker!1:1", [headers])
+        tenant.reference_cache.put("Daily Tracker!1:1", [headers])
+        tenant.tracker_index.set_headers(headers)
         await update.message.reply_text(f"Added column: {column_name}")
     except Exception as e:
         await update.message.reply_text(f"Error: {e}")
 
 async def weekly_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenants.current()
     try:
         name = ' '.join(context.args)
-        if not name:
-            service = get_sheet_service()
-            sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="People!A1:A").execute()
-            people_data = sheet.get('values', [])
+        if not name or name not in await keyboard_options("weekly"):
+            people_data = await get_people()
 
             if not people_data:
                 await update.message.reply_text("No names found. Please add names first.")
                 return
 
-            keyboard = [[InlineKeyboardButton(name[0], callback_data=f"weekly_{name[0]}")] for name in people_data]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text("Select a name to view weekly stats:", reply_markup=reply_markup)
+            # Anything other than a full name is a search.
+            await reply_keyboard(update.message, "weekly", "Select a name to view weekly stats:", name)
             return
 
-        service = get_sheet_service()
-        sheet = ensure_sheet_data(service, "Weekly Summary!A1:Z")
-
-        stats = [row for row in sheet[1:] if row[1] == name]
-        if not stats:
+        today = datetime.now(pytz.timezone(tenant.timezone)).date()
+        sections = await tenant.weekly_stats_engine.sections(name, today, WEEKLY_STATS_WEEKS)
+        if not sections:
             await update.message.reply_text(f"No stats found for {name}.")
             return
 
-        await update.message.reply_text(f"Weekly Stats for {name}:\n" + "\n".join([', '.join(row) for row in stats]))
+        await reply_pages(update.message, f"Weekly Stats for {name}:", sections, separator="\n\n")
     except Exception as e:
         await update.message.reply_text(f"Error: {e}")
 
 SELECT_NAME_GOALS, ADD_GOAL_NAME, ADD_GOAL_DESCRIPTION, SELECT_GOAL_TO_EDIT, EDIT_GOAL_DESCRIPTION = range(5)
 
+async def find_goal_row(person_name, goal_name):
+    # Always asks Sheets, as it is used to check a row before writing to it.
+    tenant = tenants.current()
+    data = await tenant.storage.read(GOAL_NAMES_RANGE)
+    return next((row_number for row_number, row in enumerate(data[1:], start=2) if row[:2] == [person_name, goal_name]), None)
+
 async def view_goals(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         name = ' '.join(context.args)
-        if not name:
-            service = get_sheet_service()
-            sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="People!A1:A").execute()
-            people_data = sheet.get('values', [])
+        if not name or name not in await keyboard_options("goals"):
+            people_data = await get_people()
 
             if not people_data:
                 await update.message.reply_text("No names found. Please add names first.")
                 return
 
-            keyboard = [[InlineKeyboardButton(name[0], callback_data=f"viewgoals_{name[0]}")] for name in people_data]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text("Select a name to view goals:", reply_markup=reply_markup)
+            # Anything other than a full name is a search.
+            await reply_keyboard(update.message, "goals", "Select a name to view goals:", name)
             return
 
-        service = get_sheet_service()
-        sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="Goals!A1:Z").execute()
-        data = sheet.get('values', [])
+        data = await read_goals()
 
         if not data or len(data) < 2:
             await update.message.reply_text(f"No goals found for {name}.")
@@ -265,108 +549,97 @@ async def view_goals(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(f"No goals found for {name}.")
             return
 
-        response = f"Goals for {name}:\n"
-        for goal in goals:
-            response += "\n".join(f"{key}: {value}" for key, value in goal.items() if value)
-            response += "\n---\n"
-
-        await update.message.reply_text(response.strip())
+        await reply_pages(update.message, f"Goals for {name}:", entry_blocks(goals))
     except Exception as e:
         await update.message.reply_text(f"Error: {e}")
 
 async def add_goal_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    service = get_sheet_service()
-    sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="People!A1:A").execute()
-    people_data = sheet.get('values', [])
+    await prefetch(update, context, cached=["People!A1:A", "Goals!1:1"])
+    people_data = await get_people()
 
     if not people_data:
         await update.message.reply_text("No names found in the 'People' sheet. Please add names first.")
-        return ConversationHandler.END
+        return END
 
-    names = [row[0] for row in people_data if len(row) > 0]
-    keyboard = [[InlineKeyboardButton(name, callback_data=name)] for name in names]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Select the person for whom you want to add a goal:", reply_markup=reply_markup)
+    if not await reply_keyboard(update.message, "people", "Select the person for whom you want to add a goal:", ' '.join(context.args)):
+        return end_conversation(update, context, GOAL_KEYS)
     return SELECT_NAME_GOALS
 
 async def add_goal_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    context.user_data["person_name"] = query.data
+    conversation(update, context)["person_name"] = query.data
 
     await query.message.reply_text("Please send the name of the new goal.")
     return ADD_GOAL_NAME
 
 async def add_goal_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     goal_name = update.message.text
-    context.user_data["goal_name"] = goal_name
+    conversation(update, context)["goal_name"] = goal_name
 
     await update.message.reply_text("Please send the description for this goal.")
     return ADD_GOAL_DESCRIPTION
 
 async def finalize_goal_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenants.current()
     goal_description = update.message.text
-    person_name = context.user_data.get("person_name")
-    goal_name = context.user_data.get("goal_name")
+    state = conversation(update, context)
+    person_name = state.get("person_name")
+    goal_name = state.get("goal_name")
 
     try:
-        service = get_sheet_service()
-        sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="Goals!A1:Z").execute()
-        data = sheet.get('values', [])
+        headers = await get_goal_headers()
 
-        if not data:
-            headers = ["Name", "Goal Name", "Description"]
-            data = [headers]
+        if not headers:
+            headers = list(GOAL_HEADERS)
+            await tenant.storage.update("Goals!A1", [headers])
+            tenant.reference_cache.put("Goals!1:1", [headers])
 
-        headers = data[0]
         new_row = ["" for _ in headers]
         new_row[0] = person_name
         new_row[1] = goal_name
         new_row[2] = goal_description
 
-        data.append(new_row)
-
-        service.values().update(
-            spreadsheetId=SPREADSHEET_ID,
-            range="Goals!A1:Z",
-            valueInputOption="RAW",
-            body={"values": data}
-        ).execute()
+        # Appending never touches existing rows, so goals added at the same
+        # time by other chats are kept.
+        await tenant.storage.append("Goals!A1", [new_row])
 
         await update.message.reply_text(f"Goal '{goal_name}' added for {person_name}.")
     except Exception as e:
         await update.message.reply_text(f"Error: {e}")
 
-    return ConversationHandler.END
+    return end_conversation(update, context, GOAL_KEYS)
 
 async def edit_goal_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    service = get_sheet_service()
-    sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="People!A1:A").execute()
-    people_data = sheet.get('values', [])
+    await prefetch(update, context, cached=["People!A1:A"], ranges=[GOAL_NAMES_RANGE])
+    people_data = await get_people()
 
     if not people_data:
         await update.message.reply_text("No names found in the 'People' sheet. Please add names first.")
-        return ConversationHandler.END
+        return END
 
-    names = [row[0] for row in people_data if len(row) > 0]
-    keyboard = [[InlineKeyboardButton(name, callback_data=name)] for name in names]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Select the person whose goal you want to edit:", reply_markup=reply_markup)
+    if not await reply_keyboard(update.message, "people", "Select the person whose goal you want to edit:", ' '.join(context.args)):
+        return end_conversation(update, context, GOAL_KEYS)
     return SELECT_GOAL_TO_EDIT
 
 async def select_goal_to_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    context.user_data["person_name"] = query.data
+    state = conversation(update, context)
+    state["person_name"] = query.data
 
-    service = get_sheet_service()
-    sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="Goals!A1:Z").execute()
-    data = sheet.get('values', [])
+    data = take_prefetched(update, context, GOAL_NAMES_RANGE)
+    if data is None:
+        data = await read_goals(last_column=1)
 
     goals = [row for row in data[1:] if row[0] == query.data]
+    state["goal_rows"] = {}
+    for row_number, row in enumerate(data[1:], start=2):
+        if row[:1] == [query.data]:
+            state["goal_rows"].setdefault(row[1], row_number)
     if not goals:
        await query.message.reply_text(f"No goals found for {query.data}.")
-       return ConversationHandler.END
+       return end_conversation(update, context, GOAL_KEYS)
     keyboard = [[InlineKeyboardButton(row[1], callback_data=row[1])] for row in goals]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.message.reply_text("Select the goal to edit:", reply_markup=reply_markup)
@@ -375,69 +648,61 @@ async def select_goal_to_edit(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def edit_goal_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
    query = update.callback_query
    await query.answer()
-   context.user_data["goal_name"] = query.data
+   conversation(update, context)["goal_name"] = query.data
 
    await query.message.reply_text("Please send the updated description for this goal:")
    return EDIT_GOAL_DESCRIPTION
 
 async def finalize_edit_goal(update: Update, context: ContextTypes.DEFAULT_TYPE):
+   tenant = tenants.current()
    updated_description = update.message.text
-   person_name = context.user_data.get("person_name")
-   goal_name = context.user_data.get("goal_name")
+   state = conversation(update, context)
+   person_name = state.get("person_name")
+   goal_name = state.get("goal_name")
 
    try:
-       service = get_sheet_service()
-       sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="Goals!A1:Z").execute()
-       data = sheet.get('values', [])
-
-       headers = data[0]
-       goal_index = next((i for i, row in enumerate(data[1:], start=1) if row[0] == person_name and row[1] == goal_name), None)
-
-       if goal_index is None:
+       # Check that the row seen when the goal was picked still holds it,
+       # reading just that row, and only then write the description cell.
+       # If rows moved in the meantime, look the goal up again.
+       row_number = state.get("goal_rows", {}).get(goal_name)
+       if row_number is not None:
+           row = await tenant.storage.read(sheets.a1_range("Goals", row_number, row_number, 0, 1))
+           if not row or row[0][:2] != [person_name, goal_name]:
+               row_number = None
+       if row_number is None:
+           row_number = await find_goal_row(person_name, goal_name)
+       if row_number is None:
            await update.message.reply_text(f"Goal '{goal_name}' for {person_name} not found.")
-           return ConversationHandler.END
+           return end_conversation(update, context, GOAL_KEYS)
 
-       while len(data[goal_index]) < len(headers):
-           data[goal_index].append("")
-
-       data[goal_index][2] = updated_description
-
-       service.values().update(
-           spreadsheetId=SPREADSHEET_ID,
-           range="Goals!A1:Z",
-           valueInputOption="RAW",
-           body={"values": data}
-       ).execute()
+       await tenant.storage.update(sheets.cell("Goals", row_number, 2), [[updated_description]])
 
        await update.message.reply_text(f"Goal '{goal_name}' for {person_name} updated successfully.")
    except Exception as e:
        await update.message.reply_text(f"Error: {e}")
 
-   return ConversationHandler.END
+   return end_conversation(update, context, GOAL_KEYS)
 
 async def handle_weekly_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+   tenant = tenants.current()
    query = update.callback_query
    await query.answer()
    name = query.data.replace("weekly_", "")
    
-   service = get_sheet_service()
-   sheet = ensure_sheet_data(service, "Weekly Summary!A1:Z")
-
-   stats = [row for row in sheet[1:] if row[1] == name]
-   if not stats:
+   today = datetime.now(pytz.timezone(tenant.timezone)).date()
+   sections = await tenant.weekly_stats_engine.sections(name, today, WEEKLY_STATS_WEEKS)
+   if not sections:
        await query.message.reply_text(f"No stats found for {name}.")
        return
 
-   await query.message.reply_text(f"Weekly Stats for {name}:\n" + "\n".join([', '.join(row) for row in stats]))
+   await reply_pages(query.message, f"Weekly Stats for {name}:", sections, separator="\n\n")
 
 async def handle_viewgoals_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
    query = update.callback_query
    await query.answer()
    name = query.data.replace("viewgoals_", "")
    
-   service = get_sheet_service()
-   sheet = service.values().get(spreadsheetId=SPREADSHEET_ID, range="Goals!A1:Z").execute()
-   data = sheet.get('values', [])
+   data = await read_goals()
 
    if not data or len(data) < 2:
        await query.message.reply_text(f"No goals found for {name}.")
@@ -450,12 +715,7 @@ async def handle_viewgoals_callback(update: Update, context: ContextTypes.DEFAUL
        await query.message.reply_text(f"No goals found for {name}.")
        return
 
-   response = f"Goals for {name}:\n"
-   for goal in goals:
-       response += "\n".join(f"{key}: {value}" for key, value in goal.items() if value)
-       response += "\n---\n"
-
-   await query.message.reply_text(response.strip())
+   await reply_pages(query.message, f"Goals for {name}:", entry_blocks(goals))
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
    await update.message.reply_text(
@@ -467,57 +727,42 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 SELECT_NAME, INPUT_UPDATES = range(2)
 
 async def batch_update_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    service = get_sheet_service()
-    sheet_data = service.values().get(spreadsheetId=SPREADSHEET_ID, range="People!A1:A").execute()
-    people_data = sheet_data.get('values', [])
+    people_data = await get_people()
 
     if not people_data:
         await update.message.reply_text("No names found in the 'People' sheet. Please add names first.")
-        return ConversationHandler.END
+        return END
 
-    names = [row[0] for row in people_data if len(row) > 0]
-    keyboard = [[InlineKeyboardButton(name, callback_data=name)] for name in names]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text("Select the person you want to update:", reply_markup=reply_markup)
+    if not await reply_keyboard(update.message, "people", "Select the person you want to update:", ' '.join(context.args)):
+        return end_conversation(update, context, BATCH_KEYS)
     return SELECT_NAME
 
 
 async def batch_update_columns(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenants.current()
     query = update.callback_query
     await query.answer()
-    context.user_data["name"] = query.data
+    name = query.data
+    today_date = datetime.now(pytz.timezone(tenant.timezone)).strftime("%Y-%m-%d")
 
-    service = get_sheet_service()
-    sheet_response = service.values().get(spreadsheetId=SPREADSHEET_ID, range="Daily Tracker!A1:Z").execute()
-    sheet_data = sheet_response.get('values', [])
+    row_number, row_to_update = await tenant.tracker_index.get_row(today_date, name)
+    headers = tenant.tracker_index.headers
 
-    if not sheet_data or len(sheet_data) < 1:
+    if not headers:
         await query.message.reply_text("No data found in the tracker. Please add headers first.")
-        return ConversationHandler.END
-
-    headers = sheet_data[0]
+        return END
 
     if len(headers) < 2:
         await query.message.reply_text("No valid headers found in the tracker. Please check your spreadsheet.")
-        return ConversationHandler.END
-
-    name = context.user_data["name"]
-    today_date = datetime.now(pytz.timezone(TIMEZONE)).strftime("%Y-%m-%d")
-
-    rows = sheet_data[1:]
-    row_index = next(
-        (i for i, row in enumerate(rows, 1) if len(row) > 1 and row[0] == today_date and row[1] == name),
-        None
-    )
+        return END
 
-    if row_index is None:
+    if row_number is None:
         row_to_update = [today_date, name] + [""] * (len(headers) - 2)
-        sheet_data.append(row_to_update)
-    else:
-        row_to_update = rows[row_index - 1]
 
     while len(row_to_update) < len(headers):
         row_to_update.append("")
+    if tenant.write_behind:
+        row_to_update = tenant.write_behind.apply(headers, row_to_update)
 
     columns = headers[2:]
     template = "\n".join(
@@ -529,158 +774,258 @@ async def batch_update_columns(update: Update, context: ContextTypes.DEFAULT_TYP
     )
 
     await query.message.reply_text(template)
-    context.user_data["sheet_data"] = sheet_data
-    context.user_data["row_index"] = len(sheet_data) - 1 if row_index is None else row_index
-    context.user_data["columns"] = columns
+    # Only the non-empty template values are kept, to tell later which cells
+    # the user changed and whether someone else changed them meanwhile. The
+    # state stays the same size however large the sheet grows.
+    conversation(update, context)["batch"] = {
+        "name": name,
+        "date": today_date,
+        "values": {column: value for column, value in zip(headers[2:], row_to_update[2:]) if value},
+    }
     return INPUT_UPDATES
 
 
 
+async def save_row_edits(date, name, shown, edits):
+    # Compare-before-write for one tracker row. The row is read again and each
+    # edited cell is only written if it still holds the value shown to the
+    # user; edits that match what is already there are skipped. Returns the
+    # (column, current value, edit) of cells someone else changed meanwhile.
+    tenant = tenants.current()
+    async with tenant.tracker_index.row_lock(date, name):
+        row_number, current = await tenant.tracker_index.get_row(date, name)
+        headers = tenant.tracker_index.headers
+        if row_number is None:
+            # Nobody has added the row yet, so nothing can conflict.
+            new_row = [date, name] + [""] * (len(headers) - 2)
+            for column, value in edits.items():
+                new_row[tenant.tracker_index.columns[column]] = value
+            updated_range = await tenant.storage.append("Daily Tracker!A1", [new_row])
+            tenant.tracker_index.record_append(updated_range, [new_row])
+            return []
+
+        changed = {}
+        conflicts = []
+        for column, value in edits.items():
+            column_index = tenant.tracker_index.columns[column]
+            now = current[column_index] if len(current) > column_index else ""
+            if now == value:
+                continue
+            if now != shown.get(column, ""):
+                conflicts.append((column, now, value))
+                continue
+            changed[column_index] = value
+
+        if changed:
+            await tenant.storage.batch_update([
+                {"range": sheets.cell("Daily Tracker", row_number, column_index), "values": [[value]]}
+                for column_index, value in changed.items()
+            ])
+            tenant.weekly_stats_engine.invalidate(date)
+        return conflicts
+
 async def batch_update_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenants.current()
+    state = conversation(update, context).get("batch")
+    if state is None:
+        return await conversation_expired(update, context, "batchupdate")
+
     try:
         updates = update.message.text.split("\n")
         updates = {item.split(":", 1)[0].strip(): item.split(":", 1)[1].strip() for item in updates if ":" in item and item.split(":", 1)[1].strip()}
 
-        sheet_data = context.user_data["sheet_data"]
-        row_index = context.user_data["row_index"]
-        headers = sheet_data[0]
-
-        for column, value in updates.items():
-            if column in headers:
-                column_index = headers.index(column)
-                sheet_data[row_index][column_index] = value
-
-        service = get_sheet_service()
-        service.values().update(
-            spreadsheetId=SPREADSHEET_ID,
-            range="Daily Tracker!A1:Z",
-            valueInputOption="RAW",
-            body={"values": sheet_data}
-        ).execute()
-
-        await update.message.reply_text(f"Batch updates successfully saved for {context.user_data['name']}.")
+        # Only values the user changed from the template are written; Date
+        # and Name are not editable.
+        shown = state["values"]
+        edits = {
+            column: value for column, value in updates.items()
+            if tenant.tracker_index.columns.get(column, 0) >= 2 and shown.get(column, "") != value
+        }
+
+        if tenant.write_behind:
+            if edits:
+                tenant.write_behind.enqueue(state["date"], state["name"], edits)
+            await update.message.reply_text(f"Batch updates successfully saved for {state['name']}.")
+            return end_conversation(update, context, BATCH_KEYS)
+
+        conflicts = await save_row_edits(state["date"], state["name"], shown, edits)
+
+        if conflicts:
+            lines = [f"{column}: kept '{current}' (yours: '{value}')" for column, current, value in conflicts]
+            await update.message.reply_text(
+                f"Batch updates saved for {state['name']}, except for values someone else changed "
+                "since your template:\n" + "\n".join(lines) + "\nRun /batchupdate again to overwrite them."
+            )
+        else:
+            await update.message.reply_text(f"Batch updates successfully saved for {state['name']}.")
     except Exception as e:
         await update.message.reply_text(f"Error processing batch update: {e}")
 
-    return ConversationHandler.END
+    return end_conversation(update, context, BATCH_KEYS)
 
+IMPORT_FILE = 0
+# Telegram lets bots download files up to 20 MB.
+IMPORT_SIZE_LIMIT = 20 * 1024 * 1024
 
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Update operation cancelled.")
-    return ConversationHandler.END
-
-def run_async(coroutine, *args, **kwargs):
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    return loop.run_until_complete(coroutine(*args, **kwargs))
-
-def daily_reminder_wrapper(chat_id, context):
-    try:
-        run_async(daily_reminder, chat_id, context)
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(daily_reminder(chat_id, context))
-        finally:
-            loop.close()
-
-def water_reminder_wrapper(chat_id, context):
-    try:
-        run_async(water_reminder, chat_id, context)
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(water_reminder(chat_id, context))
-        finally:
-            loop.close()
+async def import_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "Send the .csv or .xlsx file to import, laid out like the Daily Tracker tab of the sample sheet: "
+        "Date (YYYY-MM-DD), Name, then one column per tracker column. Rows already in the sheet are "
+        "updated with the non-empty values of the file, other rows are added. Send /cancel to stop."
+    )
+    return IMPORT_FILE
+
+async def import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tenant = tenants.current()
+    document = update.message.document
+    extension = os.path.splitext(document.file_name or "")[1].lower()
+    if extension not in (".csv", ".xlsx"):
+        await update.message.reply_text("Please send a .csv or .xlsx file, or /cancel.")
+        return IMPORT_FILE
+    if document.file_size and document.file_size > IMPORT_SIZE_LIMIT:
+        await update.message.reply_text("Telegram only lets bots download files up to 20 MB. Split the file and import the parts.")
+        return end_conversation(update, context, ())
 
-async def daily_reminder(chat_id, context: ContextTypes.DEFAULT_TYPE):
     try:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="Good evening! Don't forget to update your fitness tracker today. 🏋️‍♂️"
-        )
+        await update.message.reply_text("Importing...")
+        # Changes still in the journal are written first, so the file has
+        # the last word.
+        if tenant.write_behind:
+            await tenant.write_behind.flush()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "import" + extension)
+            file = await document.get_file()
+            await file.download_to_drive(path)
+            result = await bulk.import_rows(bulk.table_rows(path), tenant.tracker_index, tenant.storage)
+        invalidate_weeks(tenant, result["dates"])
+
+        people = {row[0] for row in await get_people() if row}
+        new_people = sorted(result["names"] - people)
+        if new_people:
+            await tenant.storage.append("People!A1", [[name] for name in new_people])
+            people_data = tenant.reference_cache.peek("People!A1:A")
+            if people_data is not None:
+                tenant.reference_cache.put("People!A1:A", people_data + [[name] for name in new_people])
+
+        lines = [f"Imported {result['rows']} rows: {result['added']} added, {result['updated']} updated."]
+        if result["skipped"]:
+            lines.append(f"Skipped {result['skipped']} rows without a name or a YYYY-MM-DD date.")
+        if new_people:
+            lines.append(f"Added to the People tab: {', '.join(new_people)}")
+        if result["ignored_columns"]:
+            lines.append(
+                f"Ignored columns the tracker does not have: {', '.join(result['ignored_columns'])}. "
+                "Add them with /addcolumns and import again to keep them."
+            )
+        if len(lines) == 1:
+            await update.message.reply_text(lines[0])
+        else:
+            # The list of new people can be long.
+            await reply_pages(update.message, lines[0], lines[1:])
     except Exception as e:
-        print(f"Error in daily reminder: {e}")
+        await update.message.reply_text(f"Error importing the file: {e}")
+    return end_conversation(update, context, ())
+
+async def export_tracker(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /export [FROM] [TO] [NAME]: dates are YYYY-MM-DD, anything after them
+    # is the name of a person.
+    tenant = tenants.current()
+    args = list(context.args)
+    dates = []
+    while args and len(dates) < 2 and bulk.valid_date(args[0]):
+        dates.append(args.pop(0))
+    first_date, last_date = (dates + [None, None])[:2]
+    name = ' '.join(args) or None
 
-async def water_reminder(chat_id, context: ContextTypes.DEFAULT_TYPE):
     try:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="Time to hydrate! Drink some water now. 🥤"
-        )
+        if tenant.write_behind:
+            await tenant.write_behind.flush()
+        # Only letters, digits, "." and "-" from the arguments, so a name
+        # such as "Tom/Jerry" cannot point the path somewhere else.
+        parts = [re.sub(r"[^\w.-]", "_", part) for part in (first_date, last_date, name) if part]
+        filename = "-".join(["tracker"] + parts) + ".csv"
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, filename)
+            count = await bulk.export_rows(tenant.tracker_index, tenant.storage, path, first_date, last_date, name)
+            if not count:
+                await update.message.reply_text("No entries found for that export.")
+                return
+            with open(path, "rb") as f:
+                await update.message.reply_document(f, filename=filename, caption=f"Rows: {count}")
     except Exception as e:
-        print(f"Error in water reminder: {e}")
+        await update.message.reply_text(f"Error: {e}")
 
-async def start_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.effective_chat.id
 
-    scheduler.add_job(
-        daily_reminder_wrapper,
-        CronTrigger(hour=19, minute=0, timezone=pytz.timezone(TIMEZONE)),
-        id=f"daily_reminder_{chat_id}",
-        replace_existing=True,
-        kwargs={"chat_id": chat_id, "context": context},
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Update operation cancelled.")
+    return end_conversation(update, context)
+
+REMINDER_TEXTS = {
+    "daily": "Good evening! Don't forget to update your fitness tracker today. 🏋️‍♂️",
+    "water": "Time to hydrate! Drink some water now. 🥤",
+}
+
+async def send_reminders(kind, bot, timezone=None):
+    chats = reminder_store.chats(kind)
+    if timezone is not None:
+        # Each timezone has its own slot jobs, for the chats living in it.
+        chats = [chat_id for chat_id in chats if tenant_registry.timezone_of(chat_id) == timezone]
+    run = await broadcaster.broadcast(bot, chats, REMINDER_TEXTS[kind], label=kind)
+    for chat_id in run["forbidden"]:
+        reminder_store.unsubscribe(chat_id)
+    print(
+        f"{kind} reminders: {run['delivered']}/{run['chats']} delivered, {run['failed']} failed, "
+        f"{run['retries']} retries in {run['duration']:.1f}s "
+        f"(latency p50 {run['latency_p50']:.2f}s, p99 {run['latency_p99']:.2f}s)"
     )
+    return run
+
+def schedule_reminder_slots(bot):
+    # Slot jobs are coroutines run by the AsyncIOScheduler on the
+    # application's event loop, sending through the application's bot.
+    from apscheduler.triggers.cron import CronTrigger
+    for timezone in tenant_registry.timezones() or [TIMEZONE]:
+        for kind, hour in SLOTS:
+            scheduler.add_job(
+                send_reminders,
+                CronTrigger(hour=hour, minute=0, timezone=pytz.timezone(timezone)),
+                id=slot_job_id(kind, hour, timezone),
+                replace_existing=True,
+                kwargs={"kind": kind, "bot": bot, "timezone": timezone},
+            )
 
-    for hour in range(7, 24):  # From 7 AM to 11 PM
-        scheduler.add_job(
-            water_reminder_wrapper,
-            CronTrigger(hour=hour, minute=0, timezone=pytz.timezone(TIMEZONE)),
-            id=f"water_reminder_{chat_id}_{hour}",
-            replace_existing=True,
-            kwargs={"chat_id": chat_id, "context": context},
-        )
-
+async def start_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    reminder_store.subscribe(chat_id)
 
     await update.message.reply_text("Reminders started! You'll get daily reminders at 7:00 PM and hourly water reminders.")
 
 async def stop_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
+    reminder_store.unsubscribe(chat_id)
 
-    try:
-        scheduler.remove_job(f"daily_reminder_{chat_id}")
-    except Exception:
-        pass
-
-    for hour in range(7, 24):
-        try:
-            scheduler.remove_job(f"water_reminder_{chat_id}_{hour}")
-        except Exception:
-            pass
-
-    try:
-        await update.message.reply_text("Reminders stopped!")
-    except RuntimeError as e:
-        if "Event loop is closed" in str(e):
-            print("Event loop was closed unexpectedly, retrying in a new loop.")
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(update.message.reply_text("Reminders stopped!"))
+    await update.message.reply_text("Reminders stopped!")
 
 async def check_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    
+    kinds = reminder_store.kinds(chat_id)
+    timezone = tenants.current().timezone
+
     active_reminders = []
-    for job in scheduler.get_jobs():
-        if str(chat_id) in job.id:
-            next_run = job.next_run_time
-            if next_run:
-                next_run = next_run.strftime("%Y-%m-%d %H:%M:%S")
-                if "water_reminder" in job.id:
-                    reminder_type = "Water reminder"
-                elif "daily_reminder" in job.id:
-                    reminder_type = "Daily fitness tracker reminder"
-                active_reminders.append(f"{reminder_type}: Next run at {next_run}")
-    
+    for kind, hour in SLOTS:
+        if kind not in kinds:
+            continue
+        job = scheduler.get_job(slot_job_id(kind, hour, timezone))
+        if job and job.next_run_time:
+            active_reminders.append((job.next_run_time, kind))
+    active_reminders.sort()
+
     if active_reminders:
-        message = "Active reminders:\n" + "\n".join(active_reminders)
+        message = "Active reminders:\n" + "\n".join(
+            f"{'Water reminder' if kind == 'water' else 'Daily fitness tracker reminder'}: "
+            f"Next run at {next_run.strftime('%Y-%m-%d %H:%M:%S')}"
+            for next_run, kind in active_reminders
+        )
     else:
         message = "No active reminders found. Use /startreminders to set them up."
         
@@ -704,6 +1049,8 @@ Data tracking:
 /update - Update today's data per column for a person
 /batchupdate - Update today's data for a person in batch
 /weekly - View weekly stats for a person
+/import - Add or update many days at once from a CSV or XLSX file
+/export - Get the tracker as a CSV file, e.g. /export 2026-01-01 2026-01-31 Alice
 
 Goals:
 /viewgoals - View goals for a person
@@ -717,43 +1064,140 @@ Reminders Management:
 
 Admin commands:
 /checktime - Check the current time in your set timezone
+/botstats - Show timings and counters of the bot
 /getuserid - Get your user ID
 /cancel - Cancel current operation
 
+Commands that ask for a person also take the start of a name, e.g. /update ali, to show only matching people.
+
 You may need to reply to bot's messages explicitly in order to reply to the bot, depending on your group settings, \
 as the bot may not be able to read messages without being replied to.
 """
    )
 
+async def bot_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # The numbers cover every chat the bot serves, so only the admin's chat
+    # sees them.
+    if str(update.effective_chat.id) != str(ADMIN_ID):
+        await update.message.reply_text("Only the admin can see the bot stats.")
+        return
+    await reply_pages(update.message, "Bot stats:", metrics.summary())
+
 async def check_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    current_time = datetime.now(pytz.timezone(TIMEZONE))
+    tenant = tenants.current()
+    current_time = datetime.now(pytz.timezone(tenant.timezone))
     await update.message.reply_text(
-        f"Current time in {TIMEZONE}: {current_time.strftime('%Y-%m-%d %H:%M:%S')}"
+        f"Current time in {tenant.timezone}: {current_time.strftime('%Y-%m-%d %H:%M:%S')}"
     )
 
 def require_auth():
     def decorator(func):
         @wraps(func)
         async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-            chat_id = update.effective_chat.id
-            user_id = update.effective_user.id
-            
-            if update.effective_chat.type == "private":
-                if str(user_id) != str(ADMIN_ID):
+            # In a private chat the chat id is the user's id.
+            tenant = tenant_registry.get(update.effective_chat.id)
+
+            if tenant is None:
+                if update.effective_chat.type == "private":
                     await update.message.reply_text("You are not authorized to use this bot.")
-                    return ConversationHandler.END if isinstance(func, ConversationHandler) else None
-            else:
-                if str(chat_id) != str(ADMIN_ID):
+                else:
                     await update.message.reply_text("This bot is not authorized in this group.")
-                    return ConversationHandler.END if isinstance(func, ConversationHandler) else None
+                return None
 
+            tenants.use(tenant)
             return await func(update, context, *args, **kwargs)
         return wrapped
     return decorator
 
-def main():
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+async def select_tenant(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Runs before the other handlers of every update and makes the tenant of
+    # its chat the current one. Updates from chats the bot does not serve
+    # only get as far as the commands, which say so.
+    chat = update.effective_chat
+    tenant = tenant_registry.get(chat.id) if chat else None
+    tenants.use(tenant)
+    if tenant is None and not (update.message and update.message.text and update.message.text.startswith("/")):
+        from telegram.ext import ApplicationHandlerStop
+        raise ApplicationHandlerStop
+
+stopping = None
+
+def request_stop(application):
+    # On SIGINT/SIGTERM: stop taking new updates, give the ones already
+    # received DRAIN_TIMEOUT seconds to finish, then shut down.
+    global stopping
+    if stopping:
+        return
+    print("Stopping, finishing the updates already received...")
+
+    async def drain_and_stop():
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        await update_processor.drain(DRAIN_TIMEOUT)
+        application.stop_running()
+    stopping = asyncio.create_task(drain_and_stop())
+
+async def post_init(application: Application):
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(stop_signal, request_stop, application)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C still stops the bot, after the running updates
+    global scheduler, reminder_store
+    reminder_store = ReminderStore(REMINDERS_DB)
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    scheduler = AsyncIOScheduler(timezone=pytz.timezone(TIMEZONE))
+    schedule_reminder_slots(application.bot)
+    scheduler.start()
+    print(f"Serving {len(tenant_registry)} chats, restored reminders for {reminder_store.count()} chats.")
+    if SHEET_MIRROR or WRITE_BEHIND:
+        # Local copies and journals are kept in the background, so every
+        # tenant is built now rather than on first use.
+        for chat_id in tenant_registry.chat_ids():
+            tenant = tenant_registry.get(chat_id)
+            if tenant.mirror:
+                tenant.mirror.start()
+            if tenant.write_behind:
+                # Anything left in the journal by a previous run goes out on the first flush.
+                print(f"Write-behind enabled for {tenant.name}, {tenant.write_behind.pending_count()} journaled changes pending.")
+                tenant.write_behind.start()
+    if METRICS:
+        await metrics.start(METRICS_PORT)
+    application.create_task(sheets.prepare())
+
+async def post_shutdown(application: Application):
+    if scheduler and scheduler.running:
+        scheduler.shutdown(wait=False)
+    if METRICS:
+        await metrics.stop()
+    for tenant in tenant_registry.built():
+        if tenant.mirror:
+            await tenant.mirror.stop()
+        if tenant.write_behind:
+            try:
+                await tenant.write_behind.stop()
+            except Exception as e:
+                print(f"Error flushing tracker updates of {tenant.name} on shutdown, kept in the journal: {e}")
+
+def build_application():
+    global update_processor
+    from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ConversationHandler, MessageHandler, TypeHandler, filters
+    from updates import ChatOrderedProcessor
+
+    update_processor = ChatOrderedProcessor(UPDATE_WORKERS)
+    application = (
+        Application.builder().token(TELEGRAM_TOKEN).concurrent_updates(update_processor)
+        .post_init(post_init).post_shutdown(post_shutdown).build()
+    )
     
+    application.add_handler(TypeHandler(Update, select_tenant), group=-1)
+
+    # Page buttons can be pressed while a conversation waits for a button
+    # of its own, so they are matched before the conversations.
+    application.add_handler(CallbackQueryHandler(handle_page_callback, pattern=r'^page:[0-9a-f]+:\d+$'))
+    application.add_handler(CallbackQueryHandler(handle_keyboard_callback, pattern=r'^kb:\w+:\d+:'))
+
     # Apply decorator to all command handlers
     update_conv_handler = ConversationHandler(
         entry_points=[CommandHandler("update", require_auth()(update_start))],
@@ -762,8 +1206,10 @@ def main():
             SELECT_COLUMN: [CallbackQueryHandler(select_column)],
             UPDATE_VALUE: [CommandHandler("cancel", require_auth()(cancel)), 
                          MessageHandler(filters.TEXT & ~filters.COMMAND, update_value)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout("update", UPDATE_KEYS))],
         },
         fallbacks=[CommandHandler("cancel", require_auth()(cancel))],
+        conversation_timeout=CONVERSATION_TIMEOUT,
     )
 
     add_goal_conv_handler = ConversationHandler(
@@ -772,8 +1218,10 @@ def main():
             SELECT_NAME_GOALS: [CallbackQueryHandler(add_goal_name)],
             ADD_GOAL_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_goal_description)],
             ADD_GOAL_DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, finalize_goal_description)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout("addgoal", GOAL_KEYS))],
         },
         fallbacks=[CommandHandler("cancel", require_auth()(cancel))],
+        conversation_timeout=CONVERSATION_TIMEOUT,
     )
 
     edit_goal_conv_handler = ConversationHandler(
@@ -784,8 +1232,10 @@ def main():
                 CallbackQueryHandler(edit_goal_description),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, finalize_edit_goal),
             ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout("editgoal", GOAL_KEYS))],
         },
         fallbacks=[CommandHandler("cancel", require_auth()(cancel))],
+        conversation_timeout=CONVERSATION_TIMEOUT,
     )
 
     batch_update_handler = ConversationHandler(
@@ -793,8 +1243,20 @@ def main():
         states={
             SELECT_NAME: [CallbackQueryHandler(batch_update_columns)],
             INPUT_UPDATES: [MessageHandler(filters.TEXT & ~filters.COMMAND, batch_update_process)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout("batchupdate", BATCH_KEYS))],
         },
         fallbacks=[CommandHandler("cancel", require_auth()(cancel))],
+        conversation_timeout=CONVERSATION_TIMEOUT,
+    )
+
+    import_handler = ConversationHandler(
+        entry_points=[CommandHandler("import", require_auth()(import_start))],
+        states={
+            IMPORT_FILE: [MessageHandler(filters.Document.ALL, import_file)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout("import", ()))],
+        },
+        fallbacks=[CommandHandler("cancel", require_auth()(cancel))],
+        conversation_timeout=CONVERSATION_TIMEOUT,
     )
 
     application.add_handler(CommandHandler("start", require_auth()(start)))
@@ -812,12 +1274,36 @@ def main():
     application.add_handler(add_goal_conv_handler)
     application.add_handler(edit_goal_conv_handler)
     application.add_handler(update_conv_handler)
+    application.add_handler(import_handler)
+    application.add_handler(CommandHandler("export", require_auth()(export_tracker)))
     application.add_handler(CallbackQueryHandler(handle_weekly_callback, pattern='^weekly_'))
     application.add_handler(CallbackQueryHandler(handle_viewgoals_callback, pattern='^viewgoals_'))
 
     application.add_handler(CommandHandler("getuserid", get_user_id))
+    application.add_handler(CommandHandler("botstats", require_auth()(bot_stats)))
+
+    if METRICS:
+        # Group -1 only picks the tenant.
+        for group, handlers in application.handlers.items():
+            if group >= 0:
+                metrics.instrument_handlers(handlers)
+    return application
 
-    application.run_polling()
+def main():
+    application = build_application()
+
+    # The stop signals are handled in post_init, so updates can drain first.
+    if WEBHOOK_URL:
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=urlparse(WEBHOOK_URL).path.lstrip("/"),
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            stop_signals=None,
+        )
+    else:
+        application.run_polling(stop_signals=None)
 
 if __name__ == "__main__":
    main()
\ No newline at end of file
@@ -0,0 +1,69 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Inline keyboards for picking a person or a column. Long lists are shown
+# PAGE_SIZE buttons at a time with Prev/Next buttons, and can be narrowed
+# down by a search text. Built keyboards are kept until the list they were
+# built from changes, so the names in People or the tracker headers are
+# only turned into buttons again after one of them was edited.
+
+PAGE_SIZE = 10
+MAX_CALLBACK_DATA = 64  # bytes Telegram allows in a button's data
+
+def fit_search(kind, search, pages):
+    # The search text goes into the Prev/Next button data after
+    # "kb:{kind}:{page}:", so it is cut to the UTF-8 bytes left after that,
+    # without splitting a character.
+    room = MAX_CALLBACK_DATA - len(f"kb:{kind}:{pages}:".encode())
+    return search.encode()[:max(room, 0)].decode(errors="ignore")
+
+def matches(option, search):
+    # Case-insensitive match on the start of the option or of any word in it.
+    search = search.lower()
+    option = option.lower()
+    return option.startswith(search) or any(word.startswith(search) for word in option.split())
+
+class KeyboardCache:
+    def __init__(self, max_keyboards=256):
+        self.max_keyboards = max_keyboards
+        self.stats = {"hits": 0, "builds": 0, "rebuilds": 0}
+        self._lists = {}
+
+    def markup(self, kind, options, prefix="", search="", page=0):
+        # Returns (keyboard, number of matching options). kind names the list
+        # (and is used in the Prev/Next button data), prefix goes in front of
+        # each option in its button data.
+        options = tuple(options)
+        # len(options) is at least the number of pages, so any page number
+        # fits in the space it leaves.
+        search = fit_search(kind, search.strip(), len(options))
+        stored = self._lists.get(kind)
+        if stored is None or stored[0] != options:
+            if stored is not None:
+                self.stats["rebuilds"] += 1
+            stored = self._lists[kind] = (options, {})
+        built = stored[1]
+        key = (search, page)
+        if key in built:
+            self.stats["hits"] += 1
+            return built[key]
+        self.stats["builds"] += 1
+        if len(built) >= self.max_keyboards:
+            built.clear()
+        built[key] = self._build(kind, options, prefix, search, page)
+        return built[key]
+
+    def _build(self, kind, options, prefix, search, page):
+        found = [option for option in options if matches(option, search)] if search else list(options)
+        pages = max(1, -(-len(found) // PAGE_SIZE))
+        page = min(max(page, 0), pages - 1)
+        shown = found[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+        rows = [[InlineKeyboardButton(option, callback_data=prefix + option)] for option in shown]
+        if pages > 1:
+            navigation = []
+            if page > 0:
+                navigation.append(InlineKeyboardButton("« Prev", callback_data=f"kb:{kind}:{page - 1}:{search}"))
+            navigation.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"kb:{kind}:{page}:{search}"))
+            if page < pages - 1:
+                navigation.append(InlineKeyboardButton("Next »", callback_data=f"kb:{kind}:{page + 1}:{search}"))
+            rows.append(navigation)
+        return InlineKeyboardMarkup(rows), len(found)
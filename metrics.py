@@ -0,0 +1,219 @@
+from functools import wraps
+import asyncio
+import bisect
+import re
+import time
+
+# Timing and counting for the bot's hot paths: handlers, Sheets requests,
+# the wait for Sheets quota and event loop lag. Nothing is recorded, and the
+# handlers are not wrapped at all, unless metrics are enabled. The numbers
+# are shown by /botstats and, when a port is set, served in Prometheus text
+# format on localhost.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+        self._collectors = []
+        self._tasks = []
+        self._server = None
+
+    def observe(self, kind, name, seconds, error=False):
+        histogram = self.histograms.get((kind, name))
+        if histogram is None:
+            histogram = self.histograms[(kind, name)] = Histogram()
+        histogram.observe(seconds, error)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_collector(self, collector):
+        # collector() returns {section: {name: number}} with the current
+        # state of a component, read when the stats are shown.
+        self._collectors.append(collector)
+
+    def collect(self):
+        sections = {}
+        for collector in self._collectors:
+            try:
+                sections.update(collector())
+            except Exception as e:
+                print(f"Error collecting stats: {e}")
+        return sections
+
+    def instrument(self, callback, kind="handler", name=None):
+        name = name or getattr(callback, "__name__", "handler")
+
+        @wraps(callback)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            error = False
+            try:
+                return await callback(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                self.observe(kind, name, time.perf_counter() - start, error)
+        return timed
+
+    def instrument_handlers(self, handlers):
+        # Wraps the callback of every handler, including the ones inside
+        # conversations.
+        for handler in handlers:
+            if hasattr(handler, "states"):
+                self.instrument_handlers(handler.entry_points)
+                for state_handlers in handler.states.values():
+                    self.instrument_handlers(state_handlers)
+                self.instrument_handlers(handler.fallbacks)
+            else:
+                handler.callback = self.instrument(handler.callback)
+
+    async def _watch_loop_lag(self, interval):
+        # How much later than asked a sleep wakes up: time the loop spent
+        # busy with something else.
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.observe("loop", "lag", max(time.perf_counter() - start - interval, 0.0))
+
+    # Output.
+
+    def summary(self):
+        lines = [f"Up for {_duration(time.time() - self.started)}."]
+        if not self.enabled:
+            lines.append("Timings are off; set METRICS=true to record them.")
+        titles = {
+            "handler": "Handlers (calls, errors, p50, p99)",
+            "sheets": "Sheets requests (calls, errors, p50, p99)",
+            "quota": "Waiting for Sheets quota (requests, p50, p99)",
+            "loop": "Event loop lag (samples, p50, p99)",
+        }
+        for kind, title in titles.items():
+            rows = sorted((name, histogram) for (each, name), histogram in self.histograms.items() if each == kind)
+            if not rows:
+                continue
+            lines.append(f"\n{title}:")
+            for name, histogram in rows:
+                errors = f" {histogram.errors}," if kind in ("handler", "sheets") else ""
+                lines.append(
+                    f"{name}: {histogram.count},{errors} "
+                    f"{_ms(histogram.quantile(0.5))}, {_ms(histogram.quantile(0.99))}"
+                )
+        sections = {"Counters": dict(self.counters)}
+        sections.update(self.collect())
+        for title, values in sections.items():
+            if values:
+                lines.append(f"\n{title}:")
+                lines.extend(f"{name}: {_number(value)}" for name, value in values.items())
+        return lines
+
+    def prometheus(self):
+        lines = []
+        families = {}
+        for (kind, name), histogram in sorted(self.histograms.items()):
+            families.setdefault(kind, []).append((name, histogram))
+        for kind, histograms in families.items():
+            metric = f"fitnessbot_{kind}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for name, histogram in histograms:
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{metric}_bucket{{name="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{name="{name}"}} {histogram.total}')
+                lines.append(f'{metric}_count{{name="{name}"}} {histogram.count}')
+            lines.append(f"# TYPE fitnessbot_{kind}_errors_total counter")
+            lines.extend(f'fitnessbot_{kind}_errors_total{{name="{name}"}} {histogram.errors}' for name, histogram in histograms)
+        for name, value in self.counters.items():
+            lines.append(f"fitnessbot_{_metric_name(name)}_total {value}")
+        for section, values in self.collect().items():
+            for name, value in values.items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"fitnessbot_{_metric_name(section)}_{_metric_name(name)} {value}")
+        return "\n".join(lines) + "\n"
+
+    # Background parts, started and stopped with the bot.
+
+    async def _serve_client(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            path = request_line.split()[1] if len(request_line.split()) > 1 else b"/"
+            if path == b"/metrics":
+                status, body = "200 OK", self.prometheus().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            print(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
+
+    async def start(self, port=None, host="127.0.0.1", lag_interval=1.0):
+        self._tasks.append(asyncio.create_task(self._watch_loop_lag(lag_interval)))
+        if port:
+            self._server = await asyncio.start_server(self._serve_client, host, port)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+def _ms(seconds):
+    return "> 30 s" if seconds == float("inf") else f"{seconds * 1000:g} ms"
+
+def _number(value):
+    return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes}m" if hours else f"{minutes}m {seconds}s"
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]+", "_", str(name)).strip("_").lower()
+
+metrics = Metrics()
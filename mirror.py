@@ -0,0 +1,219 @@
+from datetime import date, timedelta
+import asyncio
+import json
+import sqlite3
+import time
+import scheduler
+import sheets
+
+# A local SQLite copy of the spreadsheet that read commands are served from.
+# A background task keeps it in step with the sheet: each sync reads the
+# small tabs whole and, from the Daily Tracker, only the rows of the last few
+# days plus anything appended since, all in one batchGet. The whole tracker is
+# read again now and then, or straight away when rows were inserted or
+# deleted by hand. Writes the bot makes itself are copied in as soon as
+# Sheets accepts them, so they never wait for a sync. The copy is kept on
+# disk, so reads keep working while Sheets is unreachable or out of quota,
+# including right after a restart.
+
+TRACKER = "Daily Tracker"
+SMALL_TABS = ("People", "Goals", "Weekly Summary")
+
+class SheetMirror:
+    def __init__(self, storage, path, interval=30.0, hot_days=8, full_sync_interval=3600.0):
+        self.storage = storage
+        self.interval = interval
+        self.hot_days = hot_days
+        self.full_sync_interval = full_sync_interval
+        self.stats = {"syncs": 0, "full_syncs": 0, "failures": 0, "rows_written": 0}
+        # Goes up whenever a stored row changes, for callers that cache
+        # results computed from the copy.
+        self.version = 0
+        self.last_error = None
+        self._titles = None
+        self._full_synced_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._writes_during_sync = None
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                " tab TEXT NOT NULL,"
+                " row_number INTEGER NOT NULL,"
+                " key1 TEXT,"
+                " key2 TEXT,"
+                " data TEXT NOT NULL,"
+                " PRIMARY KEY (tab, row_number))"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS rows_key ON rows (tab, key1, key2)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS synced (tab TEXT PRIMARY KEY, synced_at REAL NOT NULL)"
+            )
+        storage.add_write_listener(self._on_write)
+
+    # Reads. Rows come back as lists of cell values, like Sheets returns them.
+
+    def ready(self):
+        return self._connection.execute("SELECT 1 FROM synced WHERE tab = ?", (TRACKER,)).fetchone() is not None
+
+    def rows(self, tab):
+        return [json.loads(data) for data, in self._connection.execute(
+            "SELECT data FROM rows WHERE tab = ? ORDER BY row_number", (tab,)
+        )]
+
+    def headers(self, tab=TRACKER):
+        row = self._connection.execute(
+            "SELECT data FROM rows WHERE tab = ? AND row_number = 1", (tab,)
+        ).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def rows_for_dates(self, dates):
+        dates = list(dates)
+        # "+row_number" keeps SQLite on the (tab, key1) index instead of
+        # walking the whole tab in row order. The header row never matches a
+        # date.
+        return [json.loads(data) for data, in self._connection.execute(
+            f"SELECT data FROM rows WHERE tab = ? AND key1 IN ({','.join('?' * len(dates))})"
+            " ORDER BY +row_number",
+            [TRACKER] + dates,
+        )]
+
+    # Storage.
+
+    def _put(self, tab, row_number, row):
+        while row and row[-1] == "":
+            row.pop()
+        if not row:
+            self._connection.execute("DELETE FROM rows WHERE tab = ? AND row_number = ?", (tab, row_number))
+        else:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO rows (tab, row_number, key1, key2, data) VALUES (?, ?, ?, ?, ?)",
+                (tab, row_number, row[0], row[1] if len(row) > 1 else None, json.dumps(row)),
+            )
+        self.stats["rows_written"] += 1
+        self.version += 1
+
+    def _replace(self, tab, first_row, values):
+        # values are the sheet's rows from first_row to its last row. Only
+        # rows that differ from the stored ones are written.
+        stored = dict(self._connection.execute(
+            "SELECT row_number, data FROM rows WHERE tab = ? AND row_number >= ?", (tab, first_row)
+        ))
+        for offset, row in enumerate(values):
+            row = list(row)
+            while row and row[-1] == "":
+                row.pop()
+            if stored.pop(first_row + offset, None) != (json.dumps(row) if row else None):
+                self._put(tab, first_row + offset, row)
+        for row_number in stored:
+            self._put(tab, row_number, [])
+        self._connection.execute(
+            "INSERT OR REPLACE INTO synced (tab, synced_at) VALUES (?, ?)", (tab, time.time())
+        )
+
+    def _on_write(self, range, values):
+        if not values:
+            return
+        if self._writes_during_sync is not None:
+            # The sync in progress may have read the sheet before this write;
+            # it is applied again once the sync has stored what it read.
+            self._writes_during_sync.append((range, values))
+        tab, first_row, first_column = sheets.parse_start(range)
+        with self._connection:
+            for offset, new_values in enumerate(values):
+                row_number = first_row + offset
+                stored = self._connection.execute(
+                    "SELECT data FROM rows WHERE tab = ? AND row_number = ?", (tab, row_number)
+                ).fetchone()
+                row = json.loads(stored[0]) if stored else []
+                row += [""] * (first_column + len(new_values) - len(row))
+                row[first_column:first_column + len(new_values)] = new_values
+                self._put(tab, row_number, row)
+
+    # Syncing.
+
+    def _tracker_start(self):
+        # First row worth reading again: the oldest row of the last hot_days
+        # days, or the row after the last one known.
+        since = (date.today() - timedelta(days=self.hot_days)).isoformat()
+        first, last = self._connection.execute(
+            "SELECT (SELECT MIN(row_number) FROM rows WHERE tab = ? AND row_number > 1 AND key1 >= ?),"
+            " (SELECT MAX(row_number) FROM rows WHERE tab = ?)",
+            (TRACKER, since, TRACKER),
+        ).fetchone()
+        return first or (last or 1) + 1
+
+    def _stored_keys(self, row_number):
+        row = self._connection.execute(
+            "SELECT key1, key2 FROM rows WHERE tab = ? AND row_number = ?", (TRACKER, row_number)
+        ).fetchone()
+        return [value for value in row if value is not None] if row else []
+
+    async def sync(self, full=False):
+        async with self._lock:
+            self._writes_during_sync = []
+            try:
+                await self._sync(full)
+            finally:
+                writes, self._writes_during_sync = self._writes_during_sync, None
+            for range, values in writes:
+                self._on_write(range, values)
+
+    async def _sync(self, full):
+        if self._titles is None:
+            self._titles = await self.storage.sheet_titles()
+        tabs = [tab for tab in SMALL_TABS if tab in self._titles]
+        headers = self.headers()
+        full = full or not self.ready() or time.monotonic() - self._full_synced_at > self.full_sync_interval
+
+        start = 2 if full else self._tracker_start()
+        ranges = [f"'{tab}'" for tab in tabs] + [f"{TRACKER}!1:1"]
+        if headers:
+            ranges.append(sheets.width_range(TRACKER, headers, start, minimum_width=2))
+            if start > 2:
+                # The row before the window, to notice rows inserted or
+                # deleted by hand above it.
+                ranges.append(sheets.a1_range(TRACKER, start - 1, start - 1, 0, 1))
+        results = await self.storage.read_many(ranges)
+
+        sheet_headers = results[len(tabs)][0] if results[len(tabs)] else []
+        moved = start > 2 and headers and (results[-1][0] if results[-1] else []) != self._stored_keys(start - 1)
+        if not headers or sheet_headers != headers or moved:
+            full = True
+            start = 2
+            tracker_rows = await self.storage.read(sheets.width_range(TRACKER, sheet_headers, 2, minimum_width=2))
+        else:
+            tracker_rows = results[len(tabs) + 1]
+
+        with self._connection:
+            for tab, values in zip(tabs, results):
+                self._replace(tab, 1, values)
+            if self.headers() != sheet_headers:
+                self._put(TRACKER, 1, list(sheet_headers))
+            self._replace(TRACKER, start, tracker_rows)
+
+        self.stats["syncs"] += 1
+        if full:
+            self.stats["full_syncs"] += 1
+            self._full_synced_at = time.monotonic()
+
+    async def run(self):
+        scheduler.run_in_background()
+        while True:
+            try:
+                await self.sync()
+                self.last_error = None
+            except Exception as e:
+                self.stats["failures"] += 1
+                self.last_error = str(e)
+                print(f"Error syncing the local copy of the sheet, still serving the last copy: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
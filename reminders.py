@@ -0,0 +1,198 @@
+from collections import deque
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+import asyncio
+import sqlite3
+import threading
+import time
+
+# Reminder subscriptions are kept in SQLite so they survive restarts. The
+# scheduler has one job per slot and timezone (not per chat); each job looks
+# up the chats subscribed to its kind and sends to all of them.
+
+DAILY_HOUR = 19
+WATER_HOURS = range(7, 24)  # From 7 AM to 11 PM
+SLOTS = [("daily", DAILY_HOUR)] + [("water", hour) for hour in WATER_HOURS]
+KINDS = ("daily", "water")
+
+def slot_job_id(kind, hour, timezone=None):
+    return f"{kind}_reminder_{hour}_{timezone}" if timezone else f"{kind}_reminder_{hour}"
+
+class ReminderStore:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS subscriptions ("
+                " chat_id INTEGER NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " PRIMARY KEY (chat_id, kind))"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS subscriptions_kind ON subscriptions (kind, chat_id)"
+            )
+
+    def subscribe(self, chat_id, kinds=KINDS):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO subscriptions (chat_id, kind) VALUES (?, ?)",
+                [(chat_id, kind) for kind in kinds],
+            )
+
+    def unsubscribe(self, chat_id):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+
+    def kinds(self, chat_id):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT kind FROM subscriptions WHERE chat_id = ?", (chat_id,)
+            ).fetchall()
+        return {kind for kind, in rows}
+
+    def chats(self, kind):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT chat_id FROM subscriptions WHERE kind = ? ORDER BY chat_id", (kind,)
+            ).fetchall()
+        return [chat_id for chat_id, in rows]
+
+    def count(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(DISTINCT chat_id) FROM subscriptions").fetchone()[0]
+
+# Telegram allows a bot about 30 messages per second overall, one message per
+# second to the same private chat and 20 messages per minute to the same
+# group. Broadcaster sends one message to many chats through a queue worked by
+# a few coroutines, within those limits.
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def block(self, seconds):
+        # Called on RetryAfter: nobody sends until Telegram's flood wait is over.
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def _seconds(retry_after):
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+class Broadcaster:
+    def __init__(self, rate=30, spread=60, workers=10, max_attempts=3, backoff=1.0,
+                 private_interval=1.0, group_interval=3.0):
+        self.bucket = TokenBucket(rate)
+        self.spread = spread
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.private_interval = private_interval
+        self.group_interval = group_interval
+        self.runs = deque(maxlen=20)
+        self._next_send = {}
+
+    async def _wait_for_chat(self, chat_id):
+        # Group and channel ids are negative.
+        interval = self.group_interval if chat_id < 0 else self.private_interval
+        now = time.monotonic()
+        send_at = max(now, self._next_send.get(chat_id, now))
+        self._next_send[chat_id] = send_at + interval
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+    async def _deliver(self, bot, chat_id, text, due, run):
+        await asyncio.sleep(max(0.0, due - time.monotonic()))
+        for attempt in range(self.max_attempts):
+            await self._wait_for_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                run["delivered"] += 1
+                run["latencies"].append(time.monotonic() - due)
+                return
+            except RetryAfter as e:
+                self.bucket.block(_seconds(e.retry_after))
+            except Forbidden:
+                # The bot was removed from the chat or blocked by the user.
+                run["failed"] += 1
+                run["forbidden"].append(chat_id)
+                return
+            except BadRequest as e:
+                print(f"Error sending reminder to {chat_id}: {e}")
+                run["failed"] += 1
+                return
+            except NetworkError:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+            except TelegramError as e:
+                print(f"Error sending reminder to {chat_id}: {e}")
+                run["failed"] += 1
+                return
+            run["retries"] += 1
+        run["failed"] += 1
+
+    async def _worker(self, bot, text, queue, run):
+        while True:
+            chat_id, due = await queue.get()
+            try:
+                await self._deliver(bot, chat_id, text, due, run)
+            finally:
+                queue.task_done()
+
+    async def broadcast(self, bot, chat_ids, text, label="broadcast"):
+        started = time.monotonic()
+        run = {"label": label, "chats": len(chat_ids), "delivered": 0, "failed": 0,
+               "retries": 0, "forbidden": [], "latencies": []}
+
+        # Small runs go out at once; large ones are spaced evenly over
+        # `spread` seconds instead of queueing up behind the rate limit.
+        spacing = self.spread / len(chat_ids) if len(chat_ids) > self.bucket.rate else 0.0
+        queue = asyncio.Queue()
+        for position, chat_id in enumerate(chat_ids):
+            queue.put_nowait((chat_id, started + position * spacing))
+
+        workers = [
+            asyncio.create_task(self._worker(bot, text, queue, run))
+            for _ in range(min(self.workers, len(chat_ids)))
+        ]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        now = time.monotonic()
+        for chat_id, next_send in list(self._next_send.items()):
+            if next_send < now:
+                del self._next_send[chat_id]
+
+        latencies = run.pop("latencies")
+        run["duration"] = now - started
+        run["latency_p50"] = _percentile(latencies, 50)
+        run["latency_p99"] = _percentile(latencies, 99)
+        run["latency_max"] = max(latencies, default=0.0)
+        self.runs.append(run)
+        return run
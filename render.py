@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import itertools
+import time
+
+# Telegram refuses messages longer than 4096 characters. Long listings are
+# split into pages at entry boundaries; the pages are kept for a while so the
+# Prev/Next buttons under the first one can show the others without reading
+# the sheet again.
+
+MESSAGE_LIMIT = 4096
+
+def entry_blocks(entries):
+    # One "key: value" block per entry (dicts of column -> value), leaving out
+    # empty values, each closed by a "---" line.
+    for entry in entries:
+        yield "\n".join(f"{key}: {value}" for key, value in entry.items() if value) + "\n---"
+
+def _pieces(block, room):
+    # A block too long for a page on its own is cut, at line ends if it can.
+    while len(block) > room:
+        cut = block.rfind("\n", 0, room)
+        if cut <= 0:
+            cut = room
+        yield block[:cut]
+        block = block[cut:].lstrip("\n")
+    yield block
+
+def paginate(header, blocks, separator="\n", limit=MESSAGE_LIMIT):
+    # Yields pages of at most `limit` characters, each starting with header
+    # and holding as many whole blocks as fit. Pages are joined once each, so
+    # the work grows linearly with the output.
+    room = limit - len(header) - 1
+    page = []
+    size = 0
+    for block in blocks:
+        for piece in _pieces(block, room):
+            added = len(piece) + (len(separator) if page else 0)
+            if page and size + added > room:
+                yield header + "\n" + separator.join(page)
+                page = []
+                size = 0
+                added = len(piece)
+            page.append(piece)
+            size += added
+    if page:
+        yield header + "\n" + separator.join(page)
+
+class PageCache:
+    # Keeps the pages of recent listings for the Prev/Next buttons. Old
+    # listings are dropped after `ttl` seconds or once `size` newer ones
+    # were added.
+
+    def __init__(self, size=100, ttl=3600.0):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._keys = itertools.count(1)
+
+    def put(self, pages):
+        key = f"{next(self._keys):x}"
+        self._entries[key] = (time.monotonic(), pages)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return key
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            self._entries.pop(key, None)
+            return None
+        return entry[1]
+
+def page_keyboard(key, number, count):
+    buttons = []
+    if number > 0:
+        buttons.append(InlineKeyboardButton("« Prev", callback_data=f"page:{key}:{number - 1}"))
+    buttons.append(InlineKeyboardButton(f"{number + 1}/{count}", callback_data=f"page:{key}:{number}"))
+    if number < count - 1:
+        buttons.append(InlineKeyboardButton("Next »", callback_data=f"page:{key}:{number + 1}"))
+    return InlineKeyboardMarkup([buttons])
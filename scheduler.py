@@ -0,0 +1,205 @@
+from collections import deque
+from contextvars import ContextVar
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from metrics import metrics
+from storage import Storage
+
+# Google Sheets allows a limited number of read and write requests per minute
+# (60 of each per user by default) and answers 429 beyond that. Every request
+# the bot makes goes through ScheduledStorage, which keeps within those
+# budgets, lets commands people are waiting on go ahead of background work,
+# retries 429 and 5xx answers with exponential backoff, and merges identical
+# reads that are already on their way into one request.
+
+INTERACTIVE = 0
+BACKGROUND = 1
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_priority = ContextVar("sheets_priority", default=INTERACTIVE)
+
+def run_in_background():
+    # Marks the Sheets requests of the current task (and tasks it starts) as
+    # background work. Meant to be called at the top of a background loop.
+    _priority.set(BACKGROUND)
+
+def _status(error):
+    # Imported here, as the Google client is only imported with the first
+    # Sheets request.
+    from googleapiclient.errors import HttpError
+    return error.resp.status if isinstance(error, HttpError) else None
+
+class Budget:
+    # Requests of each kind allowed per `window` seconds (0: no limit).
+    # Waiting requests are let through by priority, then in the order they
+    # arrived. Background work may not use the last `reserve` share of a
+    # budget, so commands arriving after a busy sync still find room.
+
+    def __init__(self, reads_per_minute=60, writes_per_minute=60, window=60.0, reserve=0.25):
+        self.budgets = {"read": reads_per_minute, "write": writes_per_minute}
+        self.window = window
+        self.reserve = reserve
+        self._sent = {"read": deque(), "write": deque()}
+        self._blocked_until = {"read": 0.0, "write": 0.0}
+        self._waiting = {"read": [], "write": []}
+        self._conditions = {"read": asyncio.Condition(), "write": asyncio.Condition()}
+        self._counter = itertools.count()
+
+    def _wait_time(self, kind, priority):
+        now = time.monotonic()
+        sent = self._sent[kind]
+        while sent and now - sent[0] >= self.window:
+            sent.popleft()
+        wait = self._blocked_until[kind] - now
+        budget = self.budgets[kind]
+        if budget and priority != INTERACTIVE:
+            budget = max(1, int(budget * (1 - self.reserve)))
+        if budget and len(sent) >= budget:
+            wait = max(wait, sent[-budget] + self.window - now)
+        return max(wait, 0.0)
+
+    async def acquire(self, kind):
+        # Waits for a free slot; returns whether it had to wait.
+        entry = (_priority.get(), next(self._counter))
+        waiting = self._waiting[kind]
+        condition = self._conditions[kind]
+        async with condition:
+            heapq.heappush(waiting, entry)
+            try:
+                waited = False
+                while True:
+                    wait = self._wait_time(kind, entry[0]) if waiting[0] == entry else None
+                    if wait == 0:
+                        break
+                    waited = True
+                    try:
+                        await asyncio.wait_for(condition.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                self._sent[kind].append(time.monotonic())
+                return waited
+            finally:
+                waiting.remove(entry)
+                heapq.heapify(waiting)
+                condition.notify_all()
+
+    async def block(self, kind, seconds):
+        # Called on 429: nobody of this kind goes until the backoff is over.
+        self._blocked_until[kind] = max(self._blocked_until[kind], time.monotonic() + seconds)
+        async with self._conditions[kind]:
+            self._conditions[kind].notify_all()
+
+class ScheduledStorage(Storage):
+    def __init__(self, backend, reads_per_minute=60, writes_per_minute=60, retries=5,
+                 base_delay=1.0, max_delay=32.0, window=60.0, reserve=0.25, shared=None):
+        super().__init__()
+        self.backend = backend
+        self.budget = Budget(reads_per_minute, writes_per_minute, window, reserve)
+        # A Budget shared with the storages of other spreadsheets: Google
+        # counts the quota per user, and they all use the same account.
+        self.shared = shared
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"requests": 0, "merged": 0, "waited": 0, "retries": 0, "failures": 0}
+        self._in_flight = {}
+
+    def add_write_listener(self, listener):
+        # The backend reports its own writes, including ones made around the
+        # scheduler.
+        self.backend.add_write_listener(listener)
+
+    async def _acquire(self, kind):
+        start = time.perf_counter()
+        waited = await self.budget.acquire(kind)
+        if self.shared is not None:
+            waited = await self.shared.acquire(kind) or waited
+        if waited:
+            self.stats["waited"] += 1
+        if metrics.enabled:
+            metrics.observe("quota", kind, time.perf_counter() - start)
+
+    async def _block(self, kind, seconds):
+        await self.budget.block(kind, seconds)
+        if self.shared is not None:
+            await self.shared.block(kind, seconds)
+
+    async def _run(self, kind, name, make_call, retry_statuses=RETRY_STATUSES):
+        attempt = 0
+        while True:
+            await self._acquire(kind)
+            self.stats["requests"] += 1
+            start = time.perf_counter()
+            try:
+                result = await make_call()
+            except Exception as e:
+                if metrics.enabled:
+                    metrics.observe("sheets", name, time.perf_counter() - start, error=True)
+                if _status(e) not in retry_statuses or attempt >= self.retries:
+                    self.stats["failures"] += 1
+                    raise
+                delay = min(self.base_delay * 2 ** attempt, self.max_delay) * random.uniform(0.5, 1.0)
+                attempt += 1
+                self.stats["retries"] += 1
+                if _status(e) == 429:
+                    await self._block(kind, delay)
+                else:
+                    await asyncio.sleep(delay)
+                continue
+            if metrics.enabled:
+                metrics.observe("sheets", name, time.perf_counter() - start)
+            return result
+
+    async def _read(self, key, make_call):
+        # Identical reads already on their way share one request. Each caller
+        # gets its own copy of the rows, as callers may change them.
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(self._run("read", key[0], make_call))
+
+            def done(_):
+                if self._in_flight.get(key) is task:
+                    del self._in_flight[key]
+            task.add_done_callback(done)
+        else:
+            self.stats["merged"] += 1
+        return await asyncio.shield(task)
+
+    def _wrote(self):
+        # Reads started before a write may miss it, so later reads do not
+        # join them.
+        self._in_flight.clear()
+
+    # Storage.
+
+    async def read(self, range):
+        values = await self._read(("read", range), lambda: self.backend.read(range))
+        return [list(row) for row in values]
+
+    async def read_many(self, ranges):
+        results = await self._read(("read_many", tuple(ranges)), lambda: self.backend.read_many(ranges))
+        return [[list(row) for row in values] for values in results]
+
+    async def sheet_titles(self):
+        return list(await self._read(("sheet_titles",), self.backend.sheet_titles))
+
+    async def ensure_column_count(self, sheet_name, count):
+        self._wrote()
+        await self._run("write", "ensure_column_count", lambda: self.backend.ensure_column_count(sheet_name, count))
+
+    async def update(self, range, values):
+        self._wrote()
+        await self._run("write", "update", lambda: self.backend.update(range, values))
+
+    async def append(self, range, values):
+        # A 5xx may come back for an append that was saved anyway, so only
+        # refusals are retried.
+        self._wrote()
+        return await self._run("write", "append", lambda: self.backend.append(range, values), retry_statuses=(429,))
+
+    async def batch_update(self, data):
+        self._wrote()
+        await self._run("write", "batch_update", lambda: self.backend.batch_update(data))
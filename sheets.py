@@ -0,0 +1,255 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import threading
+import asyncio
+import os
+import re
+
+# One Sheets client per process: credentials, the access token, the discovery
+# document and the HTTP connections are all reused across handler calls. The
+# client is built by the first request, not at import: googleapiclient,
+# google-auth and httplib2 take longer to import than the rest of the bot
+# together, and tests and benchmarks using stand-in storage never need them.
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+HTTP_TIMEOUT = float(os.getenv('SHEETS_HTTP_TIMEOUT') or 30)
+CALL_TIMEOUT = float(os.getenv('SHEETS_CALL_TIMEOUT') or 60)
+MAX_CONCURRENCY = int(os.getenv('SHEETS_MAX_CONCURRENCY') or 8)
+
+_client_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_service = None
+_credentials = None
+_google = None  # the client classes, once imported
+_local = threading.local()
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="sheets")
+_semaphore = None
+
+_stats = {
+    "client_builds": 0,
+    "token_refreshes": 0,
+    "opened_connections": 0,
+    "reused_connections": 0,
+}
+
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] = _stats.get(key, 0) + amount
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def _load_google():
+    global _google
+    if _google is None:
+        from googleapiclient.discovery import build
+        from google.oauth2.service_account import Credentials
+        import google_auth_httplib2
+        import httplib2
+
+        class CountingCredentials(Credentials):
+            def refresh(self, request):
+                with _refresh_lock:
+                    super().refresh(request)
+                _count("token_refreshes")
+
+        class PooledHttp(httplib2.Http):
+            def request(self, uri, *args, **kwargs):
+                # httplib2 keeps one persistent connection per host in self.connections
+                _count("reused_connections" if self.connections else "opened_connections")
+                response, content = super().request(uri, *args, **kwargs)
+                body = kwargs.get("body", args[1] if len(args) > 1 else None)
+                _count("bytes_sent", len(body or b""))
+                _count("bytes_received", len(content or b""))
+                return response, content
+
+        _google = SimpleNamespace(
+            build=build,
+            Credentials=CountingCredentials,
+            Http=PooledHttp,
+            AuthorizedHttp=google_auth_httplib2.AuthorizedHttp,
+        )
+    return _google
+
+def _new_http():
+    google = _load_google()
+    return google.AuthorizedHttp(_credentials, http=google.Http(timeout=HTTP_TIMEOUT))
+
+def get_service():
+    global _service, _credentials
+    if _service is None:
+        with _client_lock:
+            if _service is None:
+                google = _load_google()
+                _credentials = google.Credentials.from_service_account_file(
+                    os.getenv('CREDENTIALS_FILE'), scopes=SCOPES
+                )
+                # static_discovery uses the discovery document bundled with
+                # googleapiclient, so building never hits the network.
+                _service = google.build(
+                    'sheets', 'v4', http=_new_http(), cache_discovery=False, static_discovery=True
+                ).spreadsheets()
+                _count("client_builds")
+    return _service
+
+async def prepare():
+    # Builds the client in the background once the bot is running, so the
+    # first command does not wait for it. If that fails, the first request
+    # fails the same way and reports it.
+    try:
+        await asyncio.get_running_loop().run_in_executor(_executor, get_service)
+    except Exception as e:
+        print(f"Error preparing the Google Sheets client: {e}")
+
+# googleapiclient executes requests synchronously and httplib2 is not thread
+# safe, so every executor thread gets its own pooled connection while sharing
+# the process-wide service and credentials.
+
+def _thread_http():
+    http = getattr(_local, "http", None)
+    if http is None:
+        http = _local.http = _new_http()
+    return http
+
+def _execute(make_request):
+    request = make_request(get_service())
+    return request.execute(http=_thread_http())
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _semaphore
+
+async def call(make_request, timeout=None):
+    # make_request receives the spreadsheets() resource and returns an
+    # unexecuted request. On timeout or cancellation the awaiting handler is
+    # released straight away; the worker thread finishes on its own once the
+    # HTTP timeout expires.
+    async with _get_semaphore():
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_executor, _execute, make_request)
+        return await asyncio.wait_for(future, timeout or CALL_TIMEOUT)
+
+async def get_values(spreadsheet_id, range, timeout=None):
+    response = await call(
+        lambda service: service.values().get(spreadsheetId=spreadsheet_id, range=range),
+        timeout=timeout,
+    )
+    return response.get('values', [])
+
+async def batch_get_values(spreadsheet_id, ranges, timeout=None):
+    # Reads several ranges in one values().batchGet request and returns their
+    # values in the same order.
+    response = await call(
+        lambda service: service.values().batchGet(spreadsheetId=spreadsheet_id, ranges=ranges),
+        timeout=timeout,
+    )
+    return [value_range.get('values', []) for value_range in response.get('valueRanges', [])]
+
+async def update_values(spreadsheet_id, range, values, timeout=None):
+    response = await call(
+        lambda service: service.values().update(
+            spreadsheetId=spreadsheet_id,
+            range=range,
+            valueInputOption="RAW",
+            body={"values": values}
+        ),
+        timeout=timeout,
+    )
+    return response
+
+async def append_values(spreadsheet_id, range, values, timeout=None):
+    response = await call(
+        lambda service: service.values().append(
+            spreadsheetId=spreadsheet_id,
+            range=range,
+            valueInputOption="RAW",
+            body={"values": values}
+        ),
+        timeout=timeout,
+    )
+    return response
+
+async def batch_update_values(spreadsheet_id, data, timeout=None):
+    # data is a list of {"range": ..., "values": ...} entries, sent together in
+    # one values().batchUpdate request.
+    response = await call(
+        lambda service: service.values().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={"valueInputOption": "RAW", "data": data}
+        ),
+        timeout=timeout,
+    )
+    return response
+
+def column_letter(index):
+    # 0 -> "A", 25 -> "Z", 26 -> "AA"
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+_A1_START = re.compile(r"^\$?([A-Za-z]*)\$?(\d*)")
+
+def parse_start(range):
+    # "Tab!B5", "'Tab'!B5:D9", "Tab!5:5" or "Tab!B:B" ->
+    # (sheet name, first row number, first column index).
+    sheet_name, _, cells = range.rpartition("!")
+    if not sheet_name:
+        sheet_name, cells = cells, ""
+    letters, digits = _A1_START.match(cells).groups()
+    column_index = 0
+    for letter in letters.upper():
+        column_index = column_index * 26 + ord(letter) - ord("A") + 1
+    return sheet_name.strip("'").replace("''", "'"), int(digits) if digits else 1, max(column_index - 1, 0)
+
+def cell(sheet_name, row_number, column_index):
+    return f"{sheet_name}!{column_letter(column_index)}{row_number}"
+
+def a1_range(sheet_name, first_row=1, last_row=None, first_column=0, last_column=None):
+    # Rows are sheet row numbers (1-based), columns are 0-based indexes. An
+    # open last_row runs to the end of the sheet; last_column defaults to
+    # first_column. Pass the header width to read exactly the columns in use.
+    if last_column is None:
+        last_column = first_column
+    end = column_letter(last_column) + ("" if last_row is None else str(last_row))
+    return f"{sheet_name}!{column_letter(first_column)}{first_row}:{end}"
+
+def width_range(sheet_name, headers, first_row=1, last_row=None, minimum_width=1):
+    # Every column that has a header, whatever its letter.
+    return a1_range(sheet_name, first_row, last_row, 0, max(len(headers), minimum_width) - 1)
+
+async def sheet_titles(spreadsheet_id, timeout=None):
+    response = await call(
+        lambda service: service.get(spreadsheetId=spreadsheet_id, fields="sheets(properties(title))"),
+        timeout=timeout,
+    )
+    return [sheet["properties"]["title"] for sheet in response.get("sheets", [])]
+
+async def ensure_column_count(spreadsheet_id, sheet_name, count, timeout=None):
+    # New tabs have 26 columns (A to Z) and writes past the grid are rejected,
+    # so grow the tab before writing a header beyond its last column.
+    response = await call(
+        lambda service: service.get(
+            spreadsheetId=spreadsheet_id, fields="sheets(properties(sheetId,title,gridProperties))"
+        ),
+        timeout=timeout,
+    )
+    for sheet in response.get("sheets", []):
+        properties = sheet["properties"]
+        if properties["title"] != sheet_name:
+            continue
+        missing = count - properties.get("gridProperties", {}).get("columnCount", 0)
+        if missing > 0:
+            await call(
+                lambda service: service.batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": [{
+                    "appendDimension": {"sheetId": properties["sheetId"], "dimension": "COLUMNS", "length": missing}
+                }]}),
+                timeout=timeout,
+            )
+        return
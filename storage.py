@@ -0,0 +1,90 @@
+import sheets
+
+# A storage backend holds one spreadsheet and offers the few operations the
+# bot needs. Ranges are A1 strings ("Daily Tracker!C5", "People!A1:A") and
+# values are lists of rows of strings, as Google Sheets returns them.
+# SheetsStorage talks to Google Sheets; fake_storage.FakeStorage keeps the
+# tabs in memory so handlers can be run and benchmarked offline.
+
+class Storage:
+    def __init__(self):
+        self._write_listeners = []
+
+    def add_write_listener(self, listener):
+        # listener(range, values) is called after every write the backend
+        # accepted, with the range that was actually written.
+        self._write_listeners.append(listener)
+
+    def _notify(self, range, values):
+        for listener in self._write_listeners:
+            try:
+                listener(range, values)
+            except Exception as e:
+                print(f"Error in storage write listener: {e}")
+
+    async def read(self, range):
+        raise NotImplementedError
+
+    async def read_many(self, ranges):
+        # Values of several ranges, in the same order, in one request.
+        raise NotImplementedError
+
+    async def sheet_titles(self):
+        raise NotImplementedError
+
+    async def ensure_column_count(self, sheet_name, count):
+        raise NotImplementedError
+
+    async def update(self, range, values):
+        await self._update(range, values)
+        self._notify(range, values)
+
+    async def append(self, range, values):
+        # Adds the rows after the last row of the table in range and returns
+        # the range they were written to.
+        updated_range = await self._append(range, values)
+        self._notify(updated_range, values)
+        return updated_range
+
+    async def batch_update(self, data):
+        # data is a list of {"range": ..., "values": ...} entries, written in
+        # one request.
+        await self._batch_update(data)
+        for entry in data:
+            self._notify(entry["range"], entry["values"])
+
+    async def _update(self, range, values):
+        raise NotImplementedError
+
+    async def _append(self, range, values):
+        raise NotImplementedError
+
+    async def _batch_update(self, data):
+        raise NotImplementedError
+
+class SheetsStorage(Storage):
+    def __init__(self, spreadsheet_id):
+        super().__init__()
+        self.spreadsheet_id = spreadsheet_id
+
+    async def read(self, range):
+        return await sheets.get_values(self.spreadsheet_id, range)
+
+    async def read_many(self, ranges):
+        return await sheets.batch_get_values(self.spreadsheet_id, ranges)
+
+    async def sheet_titles(self):
+        return await sheets.sheet_titles(self.spreadsheet_id)
+
+    async def ensure_column_count(self, sheet_name, count):
+        await sheets.ensure_column_count(self.spreadsheet_id, sheet_name, count)
+
+    async def _update(self, range, values):
+        await sheets.update_values(self.spreadsheet_id, range, values)
+
+    async def _append(self, range, values):
+        response = await sheets.append_values(self.spreadsheet_id, range, values)
+        return response.get("updates", {}).get("updatedRange", range)
+
+    async def _batch_update(self, data):
+        await sheets.batch_update_values(self.spreadsheet_id, data)
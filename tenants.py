@@ -0,0 +1,90 @@
+from contextvars import ContextVar
+import json
+import pytz
+
+# One process can serve many chats, each tracking in its own spreadsheet and
+# timezone. A tenant is one such chat: the registry maps its chat id to the
+# spreadsheet and timezone, and holds the Sheets client, budget and caches
+# built for it, so nothing read for one chat is ever shown in another.
+# Tenants are built the first time their chat uses the bot, so configured
+# but quiet chats cost nothing.
+#
+# The tenant of the update being handled is kept in a context variable, set
+# before the handlers run; tasks started from there keep it.
+
+_current = ContextVar("tenant", default=None)
+
+def current():
+    return _current.get()
+
+def use(tenant):
+    _current.set(tenant)
+
+def known_timezone(name):
+    # pytz.all_timezones looks for the file of every zone the first time it
+    # is used; looking up just this one is much quicker.
+    try:
+        pytz.timezone(name)
+        return True
+    except pytz.UnknownTimeZoneError:
+        return False
+
+class Tenant:
+    # The factory given to the registry fills in the rest: storage,
+    # tracker_index, reference_cache, weekly_stats_engine, keyboard_cache,
+    # page_cache, mirror and write_behind.
+    def __init__(self, chat_id, spreadsheet_id, timezone="UTC", name=""):
+        self.chat_id = chat_id
+        self.spreadsheet_id = spreadsheet_id
+        self.timezone = timezone
+        self.name = name or str(chat_id)
+
+class TenantRegistry:
+    def __init__(self, factory):
+        self.factory = factory
+        self._configs = {}  # chat id -> (spreadsheet id, timezone, name)
+        self._tenants = {}  # chat id -> Tenant, once built
+
+    def add(self, chat_id, spreadsheet_id, timezone="UTC", name=""):
+        if not known_timezone(timezone):
+            print(f"Unknown timezone '{timezone}' for chat {chat_id}, using UTC.")
+            timezone = "UTC"
+        self._configs[int(chat_id)] = (spreadsheet_id, timezone, name)
+        self._tenants.pop(int(chat_id), None)
+
+    def load(self, path):
+        # path is a JSON list of {"chat_id", "spreadsheet_id", "timezone",
+        # "name"} objects; timezone and name may be left out.
+        with open(path) as f:
+            entries = json.load(f)
+        for entry in entries:
+            self.add(entry["chat_id"], entry["spreadsheet_id"], entry.get("timezone") or "UTC", entry.get("name", ""))
+
+    def get(self, chat_id):
+        # The tenant for chat_id, or None if the chat is not served.
+        tenant = self._tenants.get(chat_id)
+        if tenant is None:
+            config = self._configs.get(chat_id)
+            if config is None:
+                return None
+            tenant = self._tenants[chat_id] = self.factory(Tenant(chat_id, *config))
+        return tenant
+
+    def __contains__(self, chat_id):
+        return chat_id in self._configs
+
+    def __len__(self):
+        return len(self._configs)
+
+    def chat_ids(self):
+        return list(self._configs)
+
+    def built(self):
+        return list(self._tenants.values())
+
+    def timezone_of(self, chat_id):
+        config = self._configs.get(chat_id)
+        return config[1] if config else None
+
+    def timezones(self):
+        return sorted({config[1] for config in self._configs.values()})
@@ -0,0 +1,168 @@
+from contextlib import asynccontextmanager
+import asyncio
+import re
+import sheets
+
+_ROW_NUMBER = re.compile(r"!\D*(\d+)")
+
+class TrackerIndex:
+    # Keeps (date, name) -> row number and header -> column index for the
+    # Daily Tracker tab. Only the Date and Name columns of rows appended since
+    # the last sync are read, so lookups stay cheap as the sheet grows.
+
+    def __init__(self, storage, sheet_name="Daily Tracker"):
+        self.storage = storage
+        self.sheet_name = sheet_name
+        self.headers = []
+        self.columns = {}
+        self.rows = {}
+        self.by_date = {}
+        self.synced_rows = 0
+        self._syncs_started = 0
+        self._syncs_finished = 0
+        self._lock = asyncio.Lock()
+        self._row_locks = {}
+
+    def set_headers(self, headers):
+        self.headers = list(headers)
+        self.columns = {header: index for index, header in enumerate(self.headers)}
+
+    def _add(self, row_number, row):
+        if len(row) > 1:
+            self.rows[(row[0], row[1])] = row_number
+            self.by_date.setdefault(row[0], {})[row[1]] = row_number
+
+    @asynccontextmanager
+    async def row_lock(self, date, name):
+        # Serialises the bot's own read-compare-write cycles on one entry.
+        # Other rows are not blocked, and the lock is dropped once nobody
+        # holds or waits for it.
+        key = (date, name)
+        entry = self._row_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._row_locks[key]
+
+    async def sync(self, *ranges):
+        # Callers that queued up behind a sync share the next one instead of
+        # each reading the sheet again in turn. Extra ranges are read in the
+        # same request and their values returned.
+        seen = self._syncs_started
+        async with self._lock:
+            if self._syncs_finished > seen and not ranges:
+                return []
+            self._syncs_started += 1
+            started = self._syncs_started
+            start = max(self.synced_rows, 1) + 1
+            # Only the Date and Name columns are needed for the index.
+            index_ranges = [sheets.a1_range(self.sheet_name, start, None, 0, 1)]
+            if not self.synced_rows:
+                index_ranges.append(f"{self.sheet_name}!1:1")
+            results = await self.storage.read_many(index_ranges + list(ranges))
+            if not self.synced_rows:
+                header_rows = results[1]
+                self.set_headers(header_rows[0] if header_rows else [])
+                self.synced_rows = 1
+            for offset, row in enumerate(results[0]):
+                self._add(start + offset, row)
+            self.synced_rows += len(results[0])
+            self._syncs_finished = started
+            return results[len(index_ranges):]
+
+    async def reload(self):
+        async with self._lock:
+            self.rows = {}
+            self.by_date = {}
+            self.synced_rows = 0
+        await self.sync()
+
+    def record_append(self, updated_range, rows):
+        # Index rows the bot appended itself, using the row number from the
+        # range the append landed in, so the next sync does not have to read
+        # them back.
+        match = _ROW_NUMBER.search(updated_range or "")
+        if not match:
+            return
+        first = int(match.group(1))
+        for offset, row in enumerate(rows):
+            self._add(first + offset, row)
+        if first == self.synced_rows + 1:
+            self.synced_rows += len(rows)
+
+    def row_range(self, first_row, last_row=None, last_column=None):
+        if last_column is None:
+            return sheets.width_range(self.sheet_name, self.headers, first_row, last_row, minimum_width=2)
+        return sheets.a1_range(self.sheet_name, first_row, last_row, 0, max(last_column, 1))
+
+    async def _read_row(self, row_number, last_column=None):
+        values = await self.storage.read(self.row_range(row_number, row_number, last_column))
+        return values[0] if values else []
+
+    async def get_row(self, date, name, last_column=None):
+        # Returns (row_number, row) for the entry, or (None, None) if there is
+        # none yet. The row is read back to check that it still holds the
+        # entry; if rows were inserted or deleted by hand the index is rebuilt.
+        # last_column limits the read to the columns a command needs. When
+        # the row is already known it is read along with the sync.
+        row_number = self.rows.get((date, name))
+        row = None
+        if row_number is not None and self.headers:
+            values, = await self.sync(self.row_range(row_number, row_number, last_column))
+            row = values[0] if values else []
+        else:
+            await self.sync()
+        if row is None or self.rows.get((date, name)) != row_number:
+            row_number = self.rows.get((date, name))
+            if row_number is None:
+                return None, None
+            row = await self._read_row(row_number, last_column)
+        if row[:2] != [date, name]:
+            await self.reload()
+            row_number = self.rows.get((date, name))
+            if row_number is None:
+                return None, None
+            row = await self._read_row(row_number, last_column)
+        return row_number, row
+
+    async def sync_checked(self, keys):
+        # Syncs, reading back the Date and Name of every (date, name) in keys
+        # the index already knows in the same request. If any of those rows no
+        # longer holds its entry the index is rebuilt, so callers can write to
+        # the row numbers in self.rows afterwards.
+        known = [(key, self.rows[key]) for key in keys if key in self.rows]
+        results = await self.sync(*(sheets.a1_range(self.sheet_name, n, n, 0, 1) for _, n in known))
+        if any((values[0][:2] if values else []) != list(key) for (key, _), values in zip(known, results)):
+            await self.reload()
+
+    async def rows_for_date(self, date):
+        return await self.rows_for_dates([date])
+
+    async def rows_for_dates(self, dates):
+        # Rows for the same dates sit close together, so one read of the span
+        # between the first and last matching row is enough. As in get_row,
+        # the rows read back must hold the entries the index expects there;
+        # if rows were inserted or deleted by hand it is rebuilt and the span
+        # read again.
+        await self.sync()
+        for attempt in range(2):
+            expected = {
+                row_number: [date, name]
+                for date in dates for name, row_number in self.by_date.get(date, {}).items()
+            }
+            if not expected:
+                return []
+            first, last = min(expected), max(expected)
+            values = await self.storage.read(self.row_range(first, last))
+            if attempt or all(
+                row_number - first < len(values) and values[row_number - first][:2] == entry
+                for row_number, entry in expected.items()
+            ):
+                break
+            await self.reload()
+        wanted = set(dates)
+        return [row for row in values if len(row) > 1 and row[0] in wanted]
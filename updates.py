@@ -0,0 +1,120 @@
+from telegram.ext import BaseUpdateProcessor
+import asyncio
+import time
+
+# Processes updates concurrently, up to `workers` at a time, while keeping
+# the updates of each person in a chat in the order they arrived. The bot
+# mostly serves one group, so ordering by chat alone would put the whole
+# group back in one line; ordering by chat and user is what conversations
+# need, as they keep their state per person in a chat.
+#
+# This is a deliberate departure from strict per-chat order: updates from
+# two people in the same group run side by side and can finish in a
+# different order than they arrived. Writes to the same tracker entry are
+# still serialised by TrackerIndex.row_lock, so the cost is only that a
+# reply can show a sheet from just before or just after another person's
+# change. Set UPDATE_WORKERS to 1 for strict order.
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    def __init__(self, workers=8, pending=1000):
+        # pending: updates accepted at once, waiting or running. More wait
+        # in the application's queue.
+        super().__init__(pending)
+        self.workers = workers
+        self.stats = {"processed": 0, "waited_in_order": 0, "longest_line": 0, "cancelled": 0}
+        self._workers = asyncio.Semaphore(workers)
+        self._lines = {}  # (chat id, user id) -> [lock, updates waiting or running]
+        self._running = set()
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._stopping = False
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _key(self, update):
+        chat = getattr(update, "effective_chat", None)
+        user = getattr(update, "effective_user", None)
+        if chat is None and user is None:
+            return None
+        return (chat.id if chat else None, user.id if user else None)
+
+    async def do_process_update(self, update, coroutine):
+        if self._stopping:
+            # Left over after the drain timeout.
+            coroutine.close()
+            self.stats["cancelled"] += 1
+            return
+        key = self._key(update)
+        line = None
+        if key is not None:
+            line = self._lines.get(key)
+            if line is None:
+                line = self._lines[key] = [asyncio.Lock(), 0]
+            line[1] += 1
+            if line[0].locked():
+                self.stats["waited_in_order"] += 1
+            self.stats["longest_line"] = max(self.stats["longest_line"], line[1])
+        self._pending += 1
+        self._idle.clear()
+        try:
+            if line is None:
+                await self._run(coroutine)
+            else:
+                async with line[0]:
+                    await self._run(coroutine)
+        finally:
+            self._pending -= 1
+            if not self._pending:
+                self._idle.set()
+            if line is not None:
+                line[1] -= 1
+                if not line[1]:
+                    del self._lines[key]
+
+    async def _run(self, coroutine):
+        async with self._workers:
+            if self._stopping:
+                coroutine.close()
+                self.stats["cancelled"] += 1
+                return
+            task = asyncio.ensure_future(coroutine)
+            self._running.add(task)
+            try:
+                await asyncio.wait([task])
+            finally:
+                self._running.discard(task)
+            if task.cancelled():
+                self.stats["cancelled"] += 1
+                return
+            self.stats["processed"] += 1
+            task.result()
+
+    async def drain(self, timeout):
+        # Waits up to timeout seconds for the accepted updates to be handled,
+        # then cancels what is still running and drops the rest. Returns the
+        # number of updates that did not finish.
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return 0
+        except asyncio.TimeoutError:
+            pass
+        left = self._pending
+        self._stopping = True
+        for task in list(self._running):
+            task.cancel()
+        print(f"Stopped waiting for {left} updates after {time.monotonic() - start:.0f} seconds.")
+        return left
+
+    def status(self):
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "waiting or running": self._pending,
+            **self.stats,
+        }
@@ -0,0 +1,137 @@
+from datetime import date, timedelta
+import time
+
+# Weekly statistics computed from the Daily Tracker tab. Each ISO week is
+# read once through the tracker index, summarised column-wise with NumPy and
+# memoized until one of its rows changes or, as edits made directly in the
+# sheet are not seen, for at most ttl seconds. NumPy is imported by the first
+# summary rather than at startup.
+
+def week_dates(day):
+    monday = day - timedelta(days=day.weekday())
+    return [(monday + timedelta(days=offset)).isoformat() for offset in range(7)]
+
+def _number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return float("nan")
+
+def summarize(headers, rows, dates):
+    # Returns {name: {metric: stats}} for the rows of one week.
+    metrics = headers[2:]
+    if not rows or not metrics:
+        return {}
+    import numpy as np
+
+    width = len(headers)
+    cells = np.array([(row + [""] * width)[2:width] for row in rows], dtype=str)
+    names, person = np.unique([row[1] for row in rows], return_inverse=True)
+    day = np.array([dates.index(row[0]) for row in rows])
+
+    logged = np.zeros((len(names), 7, len(metrics)), dtype=bool)
+    values = np.full((len(names), 7, len(metrics)), np.nan)
+    logged[person, day] = np.char.strip(cells) != ""
+    values[person, day] = np.vectorize(_number, otypes=[float])(np.where(logged[person, day], cells, "x"))
+
+    numeric = ~np.isnan(values)
+    counts = numeric.sum(axis=1)
+    totals = np.where(numeric, values, 0).sum(axis=1)
+    means = np.divide(totals, counts, out=np.zeros_like(totals), where=counts > 0)
+    minimums = np.where(numeric, values, np.inf).min(axis=1)
+    maximums = np.where(numeric, values, -np.inf).max(axis=1)
+    days_logged = logged.sum(axis=1)
+
+    run = np.zeros((len(names), len(metrics)), dtype=int)
+    streaks = np.zeros_like(run)
+    for offset in range(7):
+        run = (run + 1) * logged[:, offset]
+        streaks = np.maximum(streaks, run)
+
+    summary = {}
+    for i, name in enumerate(names):
+        summary[str(name)] = {
+            metric: {
+                "days": int(days_logged[i, j]),
+                "streak": int(streaks[i, j]),
+                "numeric": bool(counts[i, j]),
+                "sum": float(totals[i, j]),
+                "mean": float(means[i, j]),
+                "min": float(minimums[i, j]),
+                "max": float(maximums[i, j]),
+            }
+            for j, metric in enumerate(metrics)
+        }
+    return summary
+
+def _format_number(value):
+    return f"{value:g}" if abs(value) < 1e6 else f"{value:.0f}"
+
+def format_week(dates, stats):
+    year, week, _ = date.fromisoformat(dates[0]).isocalendar()
+    lines = [f"Week {year}-W{week:02d} ({dates[0]} to {dates[-1]})"]
+    for metric, values in stats.items():
+        if not values["days"]:
+            continue
+        line = f"{metric}: {values['days']}/7 days, best streak {values['streak']}"
+        if values["numeric"]:
+            line += (
+                f", total {_format_number(values['sum'])}, avg {_format_number(values['mean'])}, "
+                f"min {_format_number(values['min'])}, max {_format_number(values['max'])}"
+            )
+        lines.append(line)
+    return "\n".join(lines) if len(lines) > 1 else None
+
+class WeeklyStats:
+    def __init__(self, tracker_index, mirror=None, ttl=60):
+        self.tracker_index = tracker_index
+        self.mirror = mirror
+        self.ttl = ttl
+        self._weeks = {}
+
+    def invalidate(self, day):
+        # day is a "YYYY-MM-DD" string of a row that was just written.
+        self._weeks.pop(week_dates(date.fromisoformat(day))[0], None)
+
+    async def week(self, day):
+        # The caller syncs the tracker index first. Appended rows change the
+        # row numbers and so the key; in-place edits made by the bot call
+        # invalidate(). Edits made by hand only change cells, so weeks read
+        # from the sheet are read again after ttl seconds. The mirror picks
+        # those up itself and bumps its version.
+        dates = week_dates(day)
+        if self.mirror and self.mirror.ready():
+            key = ("mirror", self.mirror.version)
+            cached = self._weeks.get(dates[0])
+            if cached is None or cached[0] != key:
+                cached = self._weeks[dates[0]] = (key, summarize(self.mirror.headers(), self.mirror.rows_for_dates(dates), dates), time.monotonic())
+            return dates, cached[1]
+
+        row_numbers = tuple(sorted(
+            row_number for d in dates for row_number in self.tracker_index.by_date.get(d, {}).values()
+        ))
+        key = (row_numbers, tuple(self.tracker_index.headers))
+        cached = self._weeks.get(dates[0])
+        if cached is not None and cached[0] == key and time.monotonic() - cached[2] < self.ttl:
+            return dates, cached[1]
+
+        rows = await self.tracker_index.rows_for_dates(dates)
+        summary = summarize(self.tracker_index.headers, rows, dates)
+        self._weeks[dates[0]] = (key, summary, time.monotonic())
+        return dates, summary
+
+    async def report(self, name, today, weeks=4):
+        return "\n\n".join(await self.sections(name, today, weeks))
+
+    async def sections(self, name, today, weeks=4):
+        # One formatted section per week with entries for name, newest first.
+        if not (self.mirror and self.mirror.ready()):
+            await self.tracker_index.sync()
+        sections = []
+        for offset in range(weeks):
+            dates, summary = await self.week(today - timedelta(weeks=offset))
+            if name in summary:
+                section = format_week(dates, summary[name])
+                if section:
+                    sections.append(section)
+        return sections
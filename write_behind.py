@@ -0,0 +1,153 @@
+from collections import deque
+import asyncio
+import sqlite3
+import time
+import scheduler
+import sheets
+
+# Opt-in write-behind mode for the Daily Tracker. Commands journal their
+# cell changes in SQLite and reply straight away; a background task flushes
+# the journal every few seconds, merging all pending changes into one
+# values().batchUpdate for existing rows and one append for new rows. Entries
+# stay in the journal until Sheets accepts them, so a crash or restart only
+# delays them until the next flush.
+
+class WriteBehindBuffer:
+    def __init__(self, storage, tracker_index, path, interval=5.0, on_flush=None):
+        self.storage = storage
+        self.tracker_index = tracker_index
+        self.interval = interval
+        self.on_flush = on_flush
+        self.flushes = deque(maxlen=50)
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS pending ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " date TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " column_name TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " queued_at REAL NOT NULL)"
+            )
+        self._pending = {}
+        for date, name, column, value in self._connection.execute(
+            "SELECT date, name, column_name, value FROM pending ORDER BY id"
+        ):
+            self._pending.setdefault((date, name), {})[column] = value
+
+    def enqueue(self, date, name, values):
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO pending (date, name, column_name, value, queued_at) VALUES (?, ?, ?, ?, ?)",
+                [(date, name, column, value, now) for column, value in values.items()],
+            )
+        self._pending.setdefault((date, name), {}).update(values)
+
+    def pending_count(self):
+        return sum(len(values) for values in self._pending.values())
+
+    def apply(self, headers, row):
+        # Returns the row with any changes still waiting in the journal.
+        values = self._pending.get((row[0], row[1])) if len(row) > 1 else None
+        if not values:
+            return row
+        row = row + [""] * (len(headers) - len(row))
+        for column, value in values.items():
+            if column in headers:
+                row[headers.index(column)] = value
+        return row
+
+    def overlay(self, headers, rows, date):
+        # rows for one date, plus rows that so far exist only in the journal.
+        rows = [self.apply(headers, row) for row in rows]
+        seen = {row[1] for row in rows if len(row) > 1}
+        for (pending_date, name) in self._pending:
+            if pending_date == date and name not in seen:
+                rows.append(self.apply(headers, [date, name]))
+        return rows
+
+    async def flush(self):
+        async with self._lock:
+            entries = self._connection.execute(
+                "SELECT id, date, name, column_name, value FROM pending ORDER BY id"
+            ).fetchall()
+            if not entries:
+                return None
+
+            started = time.monotonic()
+            changes = {}
+            for _, date, name, column, value in entries:
+                changes.setdefault((date, name), {})[column] = value
+
+            # Rows deleted or inserted by hand would otherwise send changes
+            # into someone else's row.
+            await self.tracker_index.sync_checked(list(changes))
+            index = self.tracker_index
+            sheet_name = index.sheet_name
+            data = []
+            new_rows = []
+            for (date, name), values in changes.items():
+                row_number = index.rows.get((date, name))
+                if row_number is None:
+                    row = [date, name] + [""] * (len(index.headers) - 2)
+                    for column, value in values.items():
+                        if column in index.columns:
+                            row[index.columns[column]] = value
+                    new_rows.append(row)
+                    continue
+                for column, value in values.items():
+                    if column in index.columns:
+                        data.append({"range": sheets.cell(sheet_name, row_number, index.columns[column]), "values": [[value]]})
+
+            if data:
+                await self.storage.batch_update(data)
+            if new_rows:
+                updated_range = await self.storage.append(f"{sheet_name}!A1", new_rows)
+                index.record_append(updated_range, new_rows)
+
+            last_id = entries[-1][0]
+            with self._connection:
+                self._connection.execute("DELETE FROM pending WHERE id <= ?", (last_id,))
+            # Changes queued while the flush was in progress stay pending.
+            for key, values in changes.items():
+                pending = self._pending.get(key, {})
+                for column, value in values.items():
+                    if pending.get(column) == value:
+                        del pending[column]
+                if not pending:
+                    self._pending.pop(key, None)
+
+            flush = {
+                "entries": len(entries),
+                "cells": len(data),
+                "new_rows": len(new_rows),
+                "requests": bool(data) + bool(new_rows),
+                "latency": time.monotonic() - started,
+                "finished": time.monotonic(),
+            }
+            self.flushes.append(flush)
+            if self.on_flush:
+                self.on_flush({date for date, _ in changes})
+            return flush
+
+    async def run(self):
+        scheduler.run_in_background()
+        while True:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing tracker updates, will retry: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()